@@ -1,15 +1,15 @@
 # This is where you build your AI for the Chess game.
-import numpy as np
-import random
 import sys
 
 from joueur.base_ai import BaseAI
 
 from games.chess import chess_classes as cc
-from games.chess import get_moves as gm
-from games.chess import check
 from games.chess import interface
 from games.chess import search
+from games.chess import timing
+from games.chess import transposition
+from games.chess import engine
+from games.chess import book
 
 
 def pretty_fen(fen, us):
@@ -81,15 +81,92 @@ class AI(BaseAI):
         """ This is called once the game starts and your AI knows its player and
             game. You can initialize your AI here.
         """
-        self.state = interface.fen_to_GameState(self.game.fen)
-        self.history_table = {}
+        tt_mb = self.get_setting("tt_mb")
+        if tt_mb == None:
+            # Default Value
+            tt_mb = transposition.DEFAULT_MB
+        else:
+            try:
+                tt_mb = float(tt_mb)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
+        # Processes searching each move, 1 for no helpers
+        threads = self.get_setting("threads")
+        if threads == None:
+            # Default Value
+            threads = 1
+        else:
+            try:
+                threads = int(threads)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
+
+        # Processes sharing out the root moves, 0 to search them all here
+        root_split = self.get_setting("root_split")
+        if root_split == None:
+            # Default Value
+            root_split = 0
+        else:
+            try:
+                root_split = int(root_split)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
+
+        # Kept for the whole game so earlier searches feed later ones
+        self.engine = engine.Engine(self.game.fen, len(self.game.history), tt_mb, threads, root_split)
+
+        # Polyglot opening book, played from while it has moves
+        book_path = self.get_setting("book")
+        self.book = book.OpeningBook(book_path) if book_path else None
+        # "weighted" picks book moves at random by weight, "best" the highest weight
+        book_select = self.get_setting("book_select")
+        self.book_best = book_select != None and book_select.lower() == "best"
+
+        # Search on the opponent's time. Booleans are "true" or "false"
+        ponder = self.get_setting("ponder")
+        self.ponder = ponder != None and ponder.lower() == "true"
+
+        # Forward pruning
+        null_move = self.get_setting("null_move")
+        if null_move != None:
+            search.null_move = null_move.lower() == "true"
+
+        null_move_r = self.get_setting("null_move_r")
+        if null_move_r != None:
+            try:
+                search.null_move_reduction = int(null_move_r)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
+
+        lmr = self.get_setting("lmr")
+        if lmr != None:
+            search.late_move_reductions = lmr.lower() == "true"
+
+        lmr_depth = self.get_setting("lmr_depth")
+        if lmr_depth != None:
+            try:
+                search.lmr_min_depth = int(lmr_depth)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
+
+        lmr_moves = self.get_setting("lmr_moves")
+        if lmr_moves != None:
+            try:
+                search.lmr_full_moves = int(lmr_moves)
+            except:
+                print("Unexpected error:", sys.exc_info()[0])
+                raise
 
     def game_updated(self):
         """ This is called every time the game's state updates, so if you are
         tracking anything you can update it here.
         """
-        self.state = interface.fen_to_GameState(self.game.fen)
-        self.state.history = self.game.history
+        self.engine.update(self.game.fen, self.game.history)
 
     def end(self, won, reason):
         """ This is called when the game ends, you can clean up your data and
@@ -100,6 +177,9 @@ class AI(BaseAI):
             reason (str): The human readable string explaining why your AI won
             or lost.
         """
+        self.engine.close()
+        if self.book:
+            self.book.close()
         #print(self.game.history)
         # replace with your end logic
 
@@ -163,6 +243,15 @@ class AI(BaseAI):
         *******************************************************************************************************
 
         """
+        if self.book:
+            book_move = self.book.pick_move(self.engine.state, self.book_best)
+            if book_move != cc.NO_MOVE:
+                # No search, so nothing to ponder on
+                self.engine.stop_pondering()
+                san_string = interface.san(cc.decode_move(book_move))
+                print("Book SAN: {}".format(san_string))
+                return san_string
+
         time_percentage = self.get_setting("time_percentage")
         if time_percentage == None:
             # Default Value
@@ -177,7 +266,7 @@ class AI(BaseAI):
         qs_depth = self.get_setting("qs_depth")
         if qs_depth == None:
             # Default Value
-            qs_depth = 2
+            qs_depth = 8
         else:
             try:
                 qs_depth = int(qs_depth)
@@ -185,18 +274,28 @@ class AI(BaseAI):
                 print("Unexpected error:", sys.exc_info()[0])
                 raise
 
-        root = search.SearchNode(self.state, None)
-
-        best_action_values = search.tl_ht_qs_ab_id_dl_minimax(root, qs_depth, self.history_table, time_percentage, self.player.time_remaining)
+        best_action_values = self.engine.search(qs_depth, time_percentage, self.player.time_remaining)
+        for depth, value, line in search.stats.lines:
+            print("Depth {}: {} PV {}".format(depth, value, " ".join(interface.san(cc.decode_move(move)) for move in line)))
+        print("Searched {} nodes in {:.3f}s".format(search.stats.total(), search.stats.elapsed / timing.NS_PER_SECOND))
         print("Best Action + Values: {}".format(best_action_values))
 
+        chosen_action = cc.NO_MOVE
         while best_action_values:
             bav = best_action_values.pop()
-            if bav[0] is not None:
+            if bav[0] != cc.NO_MOVE:
                 chosen_action = bav[0]
                 break
+        if chosen_action == cc.NO_MOVE:
+            # The search found nothing, any legal move beats none
+            print("No move from the search, playing the first legal move")
+            chosen_action = search.legal_actions(self.engine.state)[0]
 
-        san_string = interface.san(chosen_action)
+        san_string = interface.san(cc.decode_move(chosen_action))
         print("SAN: {}".format(san_string))
+
+        # Keep searching the expected reply until the opponent moves
+        if self.ponder:
+            self.engine.start_pondering(chosen_action, qs_depth)
         
         return san_string
\ No newline at end of file
@@ -0,0 +1,89 @@
+# Precomputed attack tables
+#
+# Built once at import from the bitboard shift functions. Crawler pieces get the
+# set of squares they attack from each square; sliders get one ray per direction
+# per square and stop the ray at the first blocker when they are looked up.
+
+from games.chess import chess_classes as cc
+from games.chess import bitboard
+
+########## CONSTANTS ##########
+KNIGHT_ATTACKS = tuple(bitboard.crawler_attacks(bit, cc.KNIGHT_VECTORS) for bit in bitboard.SQUARE_BB)
+KING_ATTACKS = tuple(bitboard.crawler_attacks(bit, cc.KING_VECTORS) for bit in bitboard.SQUARE_BB)
+# Squares a pawn of the color attacks from each square
+PAWN_ATTACKS = {
+    cc.WHITE_ACTIVE: tuple(bitboard.crawler_attacks(bit, cc.W_PAWN_CAPTURE_VECTORS) for bit in bitboard.SQUARE_BB),
+    cc.BLACK_ACTIVE: tuple(bitboard.crawler_attacks(bit, cc.B_PAWN_CAPTURE_VECTORS) for bit in bitboard.SQUARE_BB),
+}
+
+def _build_ray(bit, vector):
+    """Returns every square from bit along the vector to the edge of the board"""
+    ray = bitboard.EMPTY
+    bit = bitboard.shift(bit, vector)
+    while bit:
+        ray |= bit
+        bit = bitboard.shift(bit, vector)
+    return ray
+
+# Ray from each square in each direction, not including the square itself
+RAYS = {vector: tuple(_build_ray(bit, vector) for bit in bitboard.SQUARE_BB) for vector in cc.QUEEN_VECTORS}
+# Rays that head towards higher square indices (down the board or right)
+POSITIVE_VECTORS = {vector for vector in cc.QUEEN_VECTORS if vector[0] * 8 + vector[1] > 0}
+
+# (ray table, positive direction?) pairs for each slider
+BISHOP_RAYS = tuple((RAYS[vector], vector in POSITIVE_VECTORS) for vector in cc.BISHOP_VECTORS)
+ROOK_RAYS = tuple((RAYS[vector], vector in POSITIVE_VECTORS) for vector in cc.ROOK_VECTORS)
+
+def _build_lines():
+    """Returns the BETWEEN and LINE tables for every pair of squares"""
+    between = [[bitboard.EMPTY] * 64 for _ in range(64)]
+    line = [[bitboard.EMPTY] * 64 for _ in range(64)]
+    for start in range(64):
+        for vector in cc.QUEEN_VECTORS:
+            opposite = (-vector[0], -vector[1])
+            full_line = RAYS[vector][start] | RAYS[opposite][start] | bitboard.SQUARE_BB[start]
+            passed = bitboard.EMPTY
+            for end in bitboard.iter_squares(RAYS[vector][start]):
+                line[start][end] = full_line
+            # Walk outwards so the squares passed so far are the ones in between
+            bit = bitboard.shift(bitboard.SQUARE_BB[start], vector)
+            while bit:
+                between[start][bitboard.lsb(bit)] = passed
+                passed |= bit
+                bit = bitboard.shift(bit, vector)
+    return tuple(tuple(row) for row in between), tuple(tuple(row) for row in line)
+
+# Squares strictly between two squares on a line, and the whole line through them.
+# Both are empty for squares that don't share a rank, file or diagonal.
+BETWEEN, LINE = _build_lines()
+
+
+# Functions
+def ray_attacks(sq, rays, occupied):
+    """Returns the squares attacked from sq along the rays, stopping at the first
+    blocker in each direction. The blocker is included so it can be captured.
+    """
+    attacks = bitboard.EMPTY
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+def bishop_attacks(sq, occupied):
+    """Returns the squares a bishop on sq attacks"""
+    return ray_attacks(sq, BISHOP_RAYS, occupied)
+
+def rook_attacks(sq, occupied):
+    """Returns the squares a rook on sq attacks"""
+    return ray_attacks(sq, ROOK_RAYS, occupied)
+
+def queen_attacks(sq, occupied):
+    """Returns the squares a queen on sq attacks"""
+    return ray_attacks(sq, BISHOP_RAYS, occupied) | ray_attacks(sq, ROOK_RAYS, occupied)
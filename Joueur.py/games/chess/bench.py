@@ -0,0 +1,138 @@
+# Bench: searches a fixed list of positions to a fixed depth
+#
+# Gives a reproducible node count and speed to compare before and after engine
+# changes, without a game server. Run from the Joueur.py directory:
+#   python3 -m games.chess.bench
+#   python3 -m games.chess.bench -d 4 --json bench.json
+
+import argparse
+import json
+import random
+import sys
+import time
+import zlib
+
+from games.chess import chess_classes as cc
+from games.chess import history
+from games.chess import interface
+from games.chess import search
+from games.chess import timing
+from games.chess import transposition
+
+########## CONSTANTS ##########
+DEFAULT_DEPTH = 3
+DEFAULT_QS_DEPTH = 8
+DEFAULT_SEED = 5400
+
+# Openings, middlegames and endgames with both sides to move
+BENCH_POSITIONS = (
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+    "2r3k1/pp3ppp/2n1b3/3p4/3P4/2N1B3/PP3PPP/2R3K1 b - - 0 20",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "8/8/4k3/3p4/3P4/4K3/8/8 w - - 0 40",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 30",
+)
+
+
+# Functions
+def bench_position(fen, depth, qs_depth, tt_mb):
+    """Searches the FEN with iterative deepening up to depth.
+    Returns a dict of the result and the work done.
+    """
+    state = interface.fen_to_GameState(fen)
+    history_table = history.HistoryTable()
+    transposition_table = transposition.TranspositionTable(tt_mb)
+
+    pv = search.PrincipalVariation()
+    ordering = search.MoveOrdering()
+
+    search.stats.reset()
+    # No time limit, every depth is searched to the end
+    clock = timing.TimeManager()
+    start_time = time.perf_counter()
+    best_value = None
+    for iteration in range(1, depth + 1):
+        best_move, best_value = search.aspiration_search(state, iteration, qs_depth, clock, history_table, transposition_table, pv, ordering, best_value)
+        pv.new_iteration()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "fen": fen,
+        "best": interface.san(cc.decode_move(best_move)),
+        "score": best_value,
+        "pv": " ".join(interface.san(cc.decode_move(move)) for move in pv.previous),
+        "nodes": search.stats.total(),
+        "qs_nodes": search.stats.qs_nodes,
+        "see_pruned": search.stats.see_pruned,
+        "time": elapsed,
+        "nps": search.stats.total() / max(elapsed, 1e-9),
+    }
+
+def run_bench(depth=DEFAULT_DEPTH, qs_depth=DEFAULT_QS_DEPTH, seed=DEFAULT_SEED, shuffle=True, tt_mb=transposition.DEFAULT_MB, positions=BENCH_POSITIONS):
+    """Runs every bench position and prints a line for each.
+    Returns a dict of the totals, the signature and the per position results.
+    """
+    search.shuffle_moves = shuffle
+    random.seed(seed)
+
+    results = []
+    for fen in positions:
+        result = bench_position(fen, depth, qs_depth, tt_mb)
+        results.append(result)
+        print("{:>9} nodes {:>9} qs {:>7.2f}s {:>8.0f} nps  {:<8} {:>6}  {}".format(
+            result["nodes"], result["qs_nodes"], result["time"], result["nps"], result["best"], result["score"], fen))
+
+    total_nodes = sum(result["nodes"] for result in results)
+    total_qs_nodes = sum(result["qs_nodes"] for result in results)
+    total_time = sum(result["time"] for result in results)
+    # Changes whenever the search visits different nodes or picks different moves
+    signature_text = " ".join("{} {} {}".format(r["nodes"], r["best"], r["score"]) for r in results)
+    summary = {
+        "depth": depth,
+        "qs_depth": qs_depth,
+        "seed": seed if shuffle else None,
+        "nodes": total_nodes,
+        "qs_nodes": total_qs_nodes,
+        "time": total_time,
+        "nps": total_nodes / max(total_time, 1e-9),
+        "signature": "{:08x}".format(zlib.crc32(signature_text.encode())),
+        "positions": results,
+    }
+    print("===========================")
+    print("Total time (s) : {:.2f}".format(total_time))
+    print("Nodes searched : {}".format(total_nodes))
+    print("Quiescence     : {}".format(total_qs_nodes))
+    print("Nodes/second   : {:.0f}".format(summary["nps"]))
+    print("Signature      : {}".format(summary["signature"]))
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Searches a fixed set of chess positions to a fixed depth and reports nodes and speed.')
+    parser.add_argument('-d', '--depth', type=int, default=DEFAULT_DEPTH, help='the depth to search every position to')
+    parser.add_argument('-q', '--qs_depth', type=int, default=DEFAULT_QS_DEPTH, help='the quiescence depth, like the qs_depth AI setting')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='the seed for the move shuffling')
+    parser.add_argument('--no-shuffle', dest='shuffle', action='store_false', help='don\'t shuffle moves before ordering them')
+    parser.add_argument('--no-null-move', dest='null_move', action='store_false', help='turn off null move pruning, like null_move=false')
+    parser.add_argument('--no-lmr', dest='lmr', action='store_false', help='turn off late move reductions, like lmr=false')
+    parser.add_argument('--tt_mb', type=float, default=transposition.DEFAULT_MB, help='the transposition table size in MB')
+    parser.add_argument('--json', dest='json_path', default=None, help='also write the results as JSON to this file, - for stdout')
+    args = parser.parse_args(argv)
+
+    search.null_move = args.null_move
+    search.late_move_reductions = args.lmr
+    summary = run_bench(args.depth, args.qs_depth, args.seed, args.shuffle, args.tt_mb)
+    if args.json_path == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    elif args.json_path:
+        with open(args.json_path, 'w') as json_file:
+            json.dump(summary, json_file, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
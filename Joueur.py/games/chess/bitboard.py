@@ -0,0 +1,92 @@
+# Bitboard helpers for chess
+#
+# A bitboard is a 64 bit integer with one bit per square. Square indices follow
+# the (rank, file) coordinates in chess_classes: index = rank * 8 + file, so
+# square 0 is a8 and square 63 is h1. Moving "up" the board (towards rank 8)
+# therefore lowers the square index by 8.
+
+########## CONSTANTS ##########
+FULL = 0xFFFFFFFFFFFFFFFF
+EMPTY = 0
+
+FILE_A_BB = 0x0101010101010101
+FILE_B_BB = FILE_A_BB << 1
+FILE_G_BB = FILE_A_BB << 6
+FILE_H_BB = FILE_A_BB << 7
+
+RANK_8_BB = 0xFF
+RANK_7_BB = RANK_8_BB << 8
+RANK_6_BB = RANK_8_BB << 16
+RANK_3_BB = RANK_8_BB << 40
+RANK_2_BB = RANK_8_BB << 48
+RANK_1_BB = RANK_8_BB << 56
+
+# Single bit for every square
+SQUARE_BB = tuple(1 << sq for sq in range(64))
+
+# Files that a shift must clear so pieces don't wrap around the board edge
+WRAP_MASKS = {
+    -2: FULL ^ (FILE_G_BB | FILE_H_BB),
+    -1: FULL ^ FILE_H_BB,
+    0: FULL,
+    1: FULL ^ FILE_A_BB,
+    2: FULL ^ (FILE_A_BB | FILE_B_BB),
+}
+
+
+# Functions
+def square(coord):
+    """Returns the square index of a (rank, file) coordinate"""
+    return coord[0] * 8 + coord[1]
+
+def coord(sq):
+    """Returns the (rank, file) coordinate of a square index"""
+    return divmod(sq, 8)
+
+def lsb(bb):
+    """Returns the index of the least significant set bit"""
+    return (bb & -bb).bit_length() - 1
+
+def popcount(bb):
+    """Returns the number of set bits"""
+    return bin(bb).count("1")
+
+def iter_squares(bb):
+    """Yields the square index of every set bit, lowest first"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+def shift(bb, vector):
+    """Moves every bit of the bitboard by a (rank, file) vector.
+    Bits pushed off the board are dropped.
+    """
+    delta = vector[0] * 8 + vector[1]
+    if delta > 0:
+        bb = (bb << delta) & FULL
+    else:
+        bb >>= -delta
+    return bb & WRAP_MASKS[vector[1]]
+
+def crawler_attacks(bb, vectors):
+    """Returns the squares reached by a single step along each vector.
+    Used for Knights, Pawns, and Kings"""
+    attacks = EMPTY
+    for vector in vectors:
+        attacks |= shift(bb, vector)
+    return attacks
+
+def slider_attacks(bb, vectors, occupied):
+    """Returns the squares reached by sliding along each vector until blocked.
+    The blocking square is included so captures can be generated from it.
+    Used for Bishops, Rooks, and Queens.
+    """
+    attacks = EMPTY
+    empty = FULL ^ occupied
+    for vector in vectors:
+        ray = shift(bb, vector)
+        while ray:
+            attacks |= ray
+            ray = shift(ray & empty, vector)
+    return attacks
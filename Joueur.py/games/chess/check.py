@@ -1,196 +1,125 @@
 from games.chess import chess_classes as cc
-from games.chess import get_moves as gm
+from games.chess import bitboard
+from games.chess import attacks
+from games.chess import evaluation
 
-def check_direction(state, coord, vector, attack_color):
-    """Loops through the board in the direction specified. 
-    Returns the first piece encountered and its location.
-    """
-    if attack_color == cc.WHITE_ACTIVE:
-        # Determine the possible attackers
-        if vector in cc.BISHOP_VECTOR_SET:
-            enemy_pieces = {cc.W_BISHOP, cc.W_QUEEN}
-        elif vector in cc.ROOK_VECTOR_SET:
-            enemy_pieces = {cc.W_ROOK, cc.W_QUEEN}
-        # Loop
-        rank = coord[0] + vector[0]
-        column = coord[1] + vector[1]
-        while rank in cc.VALID_RANKS and column in cc.VALID_RANKS:
-            if state.board[rank, column] in enemy_pieces:
-                return True, (state.board[rank, column], (rank, column))
-            elif state.board[rank, column] in cc.BLACK_PIECES:
-                return False, None
-            rank += vector[0]
-            column += vector[1]
-        # Finished looping, no attacker
-        return False, None
-    elif attack_color ==cc.BLACK_ACTIVE:
-        # Determine the possible attackers
-        if vector in cc.BISHOP_VECTOR_SET:
-            enemy_pieces = {cc.B_BISHOP, cc.B_QUEEN}
-        elif vector in cc.ROOK_VECTOR_SET:
-            enemy_pieces = {cc.B_ROOK, cc.B_QUEEN}
-        # Loop
-        rank = coord[0] + vector[0]
-        column = coord[1] + vector[1]
-        while rank in cc.VALID_RANKS and column in cc.VALID_RANKS:
-            if state.board[rank, column] in enemy_pieces:
-                return True, (state.board[rank, column], (rank, column))
-            elif state.board[rank, column] in cc.WHITE_PIECES:
-                return False, None
-            rank += vector[0]
-            column += vector[1]
-        # Finished looping, no attacker
-        return False, None
-    else:
-        raise Exception("Wrong color")
+########## CONSTANTS ##########
+# Piece values for exchanges. The king is never captured, so its value only stops it being used early.
+EXCHANGE_VALUES = {piece: evaluation.MG_VALUES[piece.lower()] for piece in cc.PIECES}
+EXCHANGE_VALUES[cc.W_KING] = EXCHANGE_VALUES[cc.B_KING] = 20000
+EXCHANGE_VALUES[cc.NO_PIECE] = 0
+# Each color's pieces, least valuable first
+EXCHANGE_ORDER = {
+    cc.WHITE_ACTIVE: (cc.W_PAWN, cc.W_KNIGHT, cc.W_BISHOP, cc.W_ROOK, cc.W_QUEEN, cc.W_KING),
+    cc.BLACK_ACTIVE: (cc.B_PAWN, cc.B_KNIGHT, cc.B_BISHOP, cc.B_ROOK, cc.B_QUEEN, cc.B_KING),
+}
 
-def space_under_attack(state, coord, attack_color):
-    """Given a space, return whether it is under attack or not"""
-    # Find the possible moves
-    valid_knights = gm.get_crawler_moves(coord, cc.KNIGHT_VECTORS)
-    valid_kings = gm.get_crawler_moves(coord, cc.KING_VECTORS)
 
+def attackers_bitboard(state, sq, attack_color, occupied=None):
+    """Returns a bitboard of the attack_color pieces attacking the square.
+    occupied overrides the board's occupancy, e.g. to look through a piece that
+    is about to move. Pieces missing from it are not counted as attackers.
+    """
     if attack_color == cc.WHITE_ACTIVE:
-        # Pawns are moving up the board
-        p_attack_1 = (coord[0]+1, coord[1]-1)
-        p_attack_2 = (coord[0]+1, coord[1]+1)
-        # Check if the movement coordinates are on the board
-        p_attack_1_valid = gm.validate_move(p_attack_1)
-        p_attack_2_valid = gm.validate_move(p_attack_2)
-
-        # Check for Pawns
-        if p_attack_1_valid and state.board[p_attack_1] == cc.W_PAWN:
-            return True
-        if p_attack_2_valid and state.board[p_attack_2] == cc.W_PAWN:
-            return True
-        # Knights
-        for knight in valid_knights:
-            if state.board[knight] == cc.W_KNIGHT:
-                return True
-        # Kings
-        for king in valid_kings:
-            if state.board[king] == cc.W_KING:
-                return True
-        # Bishops and Queens
-        for vector in cc.BISHOP_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                return True
-        # Rooks and Queens
-        for vector in cc.ROOK_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                return True
-        return False
-
+        # White pawns attack up the board, so look where a black pawn would attack
+        pawn_attacks = attacks.PAWN_ATTACKS[cc.BLACK_ACTIVE]
     elif attack_color == cc.BLACK_ACTIVE:
-        # Pawns are moving down the board
-        p_attack_1 = (coord[0]-1, coord[1]-1)
-        p_attack_2 = (coord[0]-1, coord[1]+1)
-        # Check if the movement coordinates are on the board
-        p_attack_1_valid = gm.validate_move(p_attack_1)
-        p_attack_2_valid = gm.validate_move(p_attack_2)
-        # Check for Pawns
-        if p_attack_1_valid and state.board[p_attack_1] == cc.B_PAWN:
-            return True
-        if p_attack_2_valid and state.board[p_attack_2] == cc.B_PAWN:
-            return True
-        # Knights
-        for knight in valid_knights:
-            if state.board[knight] == cc.B_KNIGHT:
-                return True
-        # Kings
-        for king in valid_kings:
-            if state.board[king] == cc.B_KING:
-                return True
-        # Bishops and Queens
-        for vector in cc.BISHOP_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                return True, attacker
-        # Rooks and Queens
-        for vector in cc.ROOK_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                return True, attacker
-        return False
+        pawn_attacks = attacks.PAWN_ATTACKS[cc.WHITE_ACTIVE]
     else:
         raise Exception('space_under_attack: Invalid Enemy Color')
+    if occupied is None:
+        occupied = state.occupied
 
-def get_attackers(state, coord, attack_color):
-    """Given a space, return the attackers of the space
-    """
-    # Find the possible moves
-    possible_knights = gm.get_crawler_moves(coord, cc.KNIGHT_VECTORS)
-    possible_kings = gm.get_crawler_moves(coord, cc.KING_VECTORS)
+    bb = state.bitboards
+    queens = bb[cc.QUEEN_MAP[attack_color]]
 
-    attackers = []
+    attackers = pawn_attacks[sq] & bb[cc.PAWN_MAP[attack_color]]
+    attackers |= attacks.KNIGHT_ATTACKS[sq] & bb[cc.KNIGHT_MAP[attack_color]]
+    attackers |= attacks.KING_ATTACKS[sq] & bb[cc.KING_MAP[attack_color]]
+    # Bishops and Queens
+    diagonals = bb[cc.BISHOP_MAP[attack_color]] | queens
+    if diagonals:
+        attackers |= attacks.bishop_attacks(sq, occupied) & diagonals
+    # Rooks and Queens
+    lines = bb[cc.ROOK_MAP[attack_color]] | queens
+    if lines:
+        attackers |= attacks.rook_attacks(sq, occupied) & lines
+    return attackers & occupied
 
-    if attack_color == cc.WHITE_ACTIVE:
-        # Pawns are moving up the board
-        p_attack_1 = (coord[0]+1, coord[1]-1)
-        p_attack_2 = (coord[0]+1, coord[1]+1)
-        # Check if the movement coordinates are on the board
-        p_attack_1_valid = gm.validate_move(p_attack_1)
-        p_attack_2_valid = gm.validate_move(p_attack_2)
+def space_under_attack(state, sq, attack_color):
+    """Given a square index, return whether it is under attack or not"""
+    return attackers_bitboard(state, sq, attack_color) != 0
 
-        # Check for Pawns
-        if p_attack_1_valid and state.board[p_attack_1] == cc.W_PAWN:
-            attackers.append((cc.W_PAWN, p_attack_1))
-        if p_attack_2_valid and state.board[p_attack_2] == cc.W_PAWN:
-            attackers.append((cc.W_PAWN, p_attack_2))
-        # Knights
-        for knight in possible_knights:
-            if state.board[knight] == cc.W_KNIGHT:
-                attackers.append((cc.W_KNIGHT, knight))
-        # Kings
-        for king in possible_kings:
-            if state.board[king] == cc.W_KING:
-                attackers.append((cc.W_KING, king))
-        # Bishops and Queens
-        for vector in cc.BISHOP_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                attackers.append(attacker)
-        # Rooks and Queens
-        for vector in cc.ROOK_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                attackers.append(attacker)
+def get_attackers(state, sq, attack_color):
+    """Given a square index, return the (piece, square) attackers of the square
+    """
+    attackers = []
+    bb = attackers_bitboard(state, sq, attack_color)
+    while bb:
+        low = bb & -bb
+        attacker = low.bit_length() - 1
+        bb ^= low
+        attackers.append((state.squares[attacker], attacker))
+    return tuple(attackers)
 
-    elif attack_color == cc.BLACK_ACTIVE:
-        # Pawns are moving down the board
-        p_attack_1 = (coord[0]-1, coord[1]-1)
-        p_attack_2 = (coord[0]-1, coord[1]+1)
-        # Check if the movement coordinates are on the board
-        p_attack_1_valid = gm.validate_move(p_attack_1)
-        p_attack_2_valid = gm.validate_move(p_attack_2)
-        # Check for Pawns
-        if p_attack_1_valid and state.board[p_attack_1] == cc.B_PAWN:
-            attackers.append((cc.B_PAWN, p_attack_1))
-        if p_attack_2_valid and state.board[p_attack_2] == cc.B_PAWN:
-            attackers.append((cc.B_PAWN, p_attack_2))
-        # Knights
-        for knight in possible_knights:
-            if state.board[knight] == cc.B_KNIGHT:
-                attackers.append((cc.B_KNIGHT, knight))
-        # Kings
-        for king in possible_kings:
-            if state.board[king] == cc.B_KING:
-                attackers.append((cc.B_KING, king))
-        # Bishops and Queens
-        for vector in cc.BISHOP_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                attackers.append(attacker)
-        # Rooks and Queens
-        for vector in cc.ROOK_VECTORS:
-            valid, attacker = check_direction(state, coord, vector, attack_color)
-            if valid:
-                attackers.append(attacker)
+def static_exchange(state, move):
+    """Static Exchange Evaluation. Returns the material the moving color wins
+    (or loses, if negative) by making the encoded move and then both colors
+    recapturing on its end square with their least valuable attacker, each
+    stopping whenever recapturing would lose more. No moves are made: pieces
+    are taken off a copy of the occupancy instead, which uncovers the sliders
+    behind them (x-rays).
+    """
+    start = move & cc.MOVE_SQUARE_MASK
+    end = (move >> cc.MOVE_END_SHIFT) & cc.MOVE_SQUARE_MASK
+    piece = cc.INDEX_PIECE[(move >> cc.MOVE_PIECE_SHIFT) & cc.MOVE_PIECE_MASK]
+    captured = cc.INDEX_PIECE[(move >> cc.MOVE_CAPTURE_SHIFT) & cc.MOVE_PIECE_MASK]
+    promo = cc.INDEX_PIECE[(move >> cc.MOVE_PROMO_SHIFT) & cc.MOVE_PIECE_MASK]
+    bb = state.bitboards
 
-    else:
-        raise Exception('space_under_attack: Invalid Enemy Color')
+    occupied = state.occupied ^ bitboard.SQUARE_BB[start]
+    if move & cc.FLAG_EN_PASSANT:
+        occupied ^= bitboard.SQUARE_BB[start - start % 8 + end % 8]
+    # gains[d] is the material won so far if the capture sequence stops after capture d
+    gains = [EXCHANGE_VALUES[captured]]
+    if promo != cc.NO_PIECE:
+        gains[0] += EXCHANGE_VALUES[promo] - EXCHANGE_VALUES[piece]
+        piece = promo
 
-    return tuple(attackers)
+    diagonals = bb[cc.W_BISHOP] | bb[cc.B_BISHOP] | bb[cc.W_QUEEN] | bb[cc.B_QUEEN]
+    lines = bb[cc.W_ROOK] | bb[cc.B_ROOK] | bb[cc.W_QUEEN] | bb[cc.B_QUEEN]
+    attackers = attackers_bitboard(state, end, cc.WHITE_ACTIVE, occupied) | attackers_bitboard(state, end, cc.BLACK_ACTIVE, occupied)
+    color = cc.OPP_COLOR[cc.PIECE_COLOR[piece]]
+
+    while True:
+        # Value of capturing the piece that just captured
+        gains.append(EXCHANGE_VALUES[piece] - gains[-1])
+        # Neither color can do better by carrying on
+        if max(-gains[-2], gains[-1]) < 0:
+            break
+        own = attackers & state.occupancy[color]
+        if not own:
+            break
+        # Least valuable attacker
+        for attacker in EXCHANGE_ORDER[color]:
+            from_bb = own & bb[attacker]
+            if from_bb:
+                break
+        # The king can't capture onto a defended square
+        if attacker in cc.KING_SET and attackers & state.occupancy[cc.OPP_COLOR[color]]:
+            break
+        from_bb &= -from_bb
+        occupied ^= from_bb
+        # Sliders behind the piece that moved now see the square
+        attackers |= (attacks.bishop_attacks(end, occupied) & diagonals) | (attacks.rook_attacks(end, occupied) & lines)
+        attackers &= occupied
+        piece = attacker
+        color = cc.OPP_COLOR[color]
 
+    # The last gain is for a capture that wasn't made. Work back from the end,
+    # each color choosing between stopping and recapturing.
+    gains.pop()
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
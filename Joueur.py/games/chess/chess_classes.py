@@ -1,5 +1,9 @@
 from enum import Enum
 
+from games.chess import bitboard
+from games.chess import evaluation
+from games.chess import zobrist
+
 # Data structures for chess
 
 ########## CONSTANTS ##########
@@ -53,6 +57,11 @@ ROOK_MAP = {BLACK_ACTIVE:B_ROOK, WHITE_ACTIVE:W_ROOK}
 QUEEN_MAP = {BLACK_ACTIVE:B_QUEEN, WHITE_ACTIVE:W_QUEEN}
 KING_MAP = {BLACK_ACTIVE:B_KING, WHITE_ACTIVE:W_KING}
 
+# Map the pieces to their color
+PIECE_COLOR = {piece: WHITE_ACTIVE for piece in WHITE_PIECES}
+PIECE_COLOR.update({piece: BLACK_ACTIVE for piece in BLACK_PIECES})
+OPP_COLOR = {WHITE_ACTIVE:BLACK_ACTIVE, BLACK_ACTIVE:WHITE_ACTIVE}
+
 # Mapping the traditional chess ranks to their numpy array indeces
 RANK_1 = FILE_H = MAX_POS = 7
 RANK_2 = FILE_G           = 6
@@ -73,6 +82,7 @@ A_RANK_5 = "5"
 A_RANK_6 = "6"
 A_RANK_7 = "7"
 A_RANK_8 = "8"
+VALID_A_RANKS = {A_RANK_1, A_RANK_2, A_RANK_3, A_RANK_4, A_RANK_5, A_RANK_6, A_RANK_7, A_RANK_8}
 A_FILE_A = "a"
 A_FILE_B = "b"
 A_FILE_C = "c"
@@ -85,6 +95,25 @@ A_FILE_H = "h"
 NO_PIECE = " " # No piece on this square
 NO_C_EP = "-" # No castle or en passant
 
+# Move Encoding
+# A move is an int: start | end << 6 | piece << 12 | captured << 16 | promo << 20 | flags
+# Squares are 0 (a8) through 63 (h1), pieces are their PIECE_INDEX (0 for none)
+INDEX_PIECE = (NO_PIECE, W_PAWN, W_KNIGHT, W_BISHOP, W_ROOK, W_QUEEN, W_KING,
+               B_PAWN, B_KNIGHT, B_BISHOP, B_ROOK, B_QUEEN, B_KING)
+PIECE_INDEX = {piece: index for index, piece in enumerate(INDEX_PIECE)}
+MOVE_SQUARE_MASK = 0x3F
+MOVE_END_SHIFT = 6
+MOVE_PIECE_SHIFT = 12
+MOVE_CAPTURE_SHIFT = 16
+MOVE_PROMO_SHIFT = 20
+MOVE_PIECE_MASK = 0xF
+MOVE_CAPTURE_MASK = MOVE_PIECE_MASK << MOVE_CAPTURE_SHIFT
+MOVE_PROMO_MASK = MOVE_PIECE_MASK << MOVE_PROMO_SHIFT
+FLAG_DOUBLE_PUSH = 1 << 24 # Pawn moved 2, leaving an en passant square
+FLAG_EN_PASSANT = 2 << 24  # Pawn captured en passant
+FLAG_CASTLE = 4 << 24      # King castled, the end square says which side
+NO_MOVE = 0
+
 # Movement Vectors
 V_UP           = (-1, 0)
 V_UP_2         = (-2, 0)
@@ -122,19 +151,98 @@ KING_VECTOR_SET = QUEEN_VECTOR_SET
 
 # Class definitions for Chess
 class GameState:
-    """Contains all the information needed for a state of chess"""
-    __slots__ = ['board', 'active_color',  'opp_color', 'castles_avail', 'en_passant', 'halfmove', 'fullmove', 'active_king', 'inactive_king', 'history']
-    def __init__(self, board, active_color, castles_avail, en_passant, halfmove, fullmove, active_king=None, inactive_king=None, history=None):
-        self.board         = board                      # 2D Numpy array of characters
+    """Contains all the information needed for a state of chess.
+    The board is stored as one bitboard per piece plus occupancy masks, with a
+    list of the 64 squares kept alongside for piece lookups.
+    """
+    __slots__ = ['squares', 'bitboards', 'occupancy', 'occupied', 'active_color',  'opp_color', 'castles_avail', 'en_passant', 'halfmove', 'fullmove', 'active_king', 'inactive_king', 'key', 'keys', 'root_keys', 'score', 'phase']
+    def __init__(self, squares, active_color, castles_avail, en_passant, halfmove, fullmove, active_king=None, inactive_king=None):
+        self.squares       = None                       # List of 64 piece characters, a8 first
+        self.bitboards     = None                       # Bitboard for each piece
+        self.occupancy     = None                       # Bitboard of each color's pieces
+        self.occupied      = None                       # Bitboard of all the pieces
+        self.score         = None                       # Packed material and piece-square score, white's view
+        self.phase         = None                       # Game phase, MAX_PHASE at the start down to 0
+        self.set_board(squares)
         self.active_color  = active_color               # Who's moving next?
         self.opp_color     = self.get_opp_color()       # Who's the enemy?
         self.castles_avail = castles_avail              # Who can castle still?
-        self.en_passant    = alg_to_coord(en_passant)   # Square behind a pawn that just moved 2. (rank, file)
+        self.en_passant    = alg_to_square(en_passant)  # Square behind a pawn that just moved 2. 0-63 or None
         self.halfmove      = int(halfmove)              # Moves since last capture or pawn advance
         self.fullmove      = int(fullmove)              # Number of full move. Incremented after black moves
-        self.active_king   = self.find_king(self.active_color) # Active King Location
-        self.inactive_king = self.find_king(self.opp_color) # Inactive King Location
-        self.history       = history                    # Needs to be manually set in the AI File
+        self.active_king   = self.find_king(self.active_color) # Active King Square
+        self.inactive_king = self.find_king(self.opp_color) # Inactive King Square
+        self.key           = self.get_key()             # Zobrist key, updated as moves are made
+        self.keys          = []                         # Keys of the earlier positions, oldest first
+        self.root_keys     = 0                          # Length of keys at the search root, set by the search
+
+    def copy(self):
+        """Returns a copy of the state that can be changed independently"""
+        new_state = GameState.__new__(GameState)
+        new_state.squares       = list(self.squares)
+        new_state.bitboards     = dict(self.bitboards)
+        new_state.occupancy     = dict(self.occupancy)
+        new_state.occupied      = self.occupied
+        new_state.active_color  = self.active_color
+        new_state.opp_color     = self.opp_color
+        new_state.castles_avail = self.castles_avail
+        new_state.en_passant    = self.en_passant
+        new_state.halfmove      = self.halfmove
+        new_state.fullmove      = self.fullmove
+        new_state.active_king   = self.active_king
+        new_state.inactive_king = self.inactive_king
+        new_state.key           = self.key
+        new_state.keys          = list(self.keys)
+        new_state.root_keys     = self.root_keys
+        new_state.score         = self.score
+        new_state.phase         = self.phase
+        return new_state
+
+    def set_board(self, squares):
+        """Builds the bitboards, occupancy masks and evaluation totals from a list of 64 squares"""
+        self.squares = list(squares)
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {WHITE_ACTIVE: 0, BLACK_ACTIVE: 0}
+        self.occupied = 0
+        for sq, piece in enumerate(self.squares):
+            if piece != NO_PIECE:
+                bit = bitboard.SQUARE_BB[sq]
+                self.bitboards[piece] |= bit
+                self.occupancy[PIECE_COLOR[piece]] |= bit
+                self.occupied |= bit
+        self.score, self.phase = evaluation.get_score(self.squares, NO_PIECE)
+
+    def get_key(self):
+        """Computes the Zobrist key of the state from scratch"""
+        return zobrist.get_key(self.squares, self.active_color == WHITE_ACTIVE, self.castles_avail, self.en_passant)
+
+    def put_piece(self, piece, sq):
+        """Places a piece on an empty square"""
+        bit = bitboard.SQUARE_BB[sq]
+        self.squares[sq] = piece
+        self.bitboards[piece] |= bit
+        self.occupancy[PIECE_COLOR[piece]] |= bit
+        self.occupied |= bit
+        self.key ^= zobrist.PIECE_KEYS[piece][sq]
+        self.score += evaluation.PIECE_SQUARE[piece][sq]
+        self.phase += evaluation.PIECE_PHASE[piece]
+
+    def remove_piece(self, sq):
+        """Removes and returns the piece on a square"""
+        piece = self.squares[sq]
+        bit = bitboard.SQUARE_BB[sq]
+        self.squares[sq] = NO_PIECE
+        self.bitboards[piece] ^= bit
+        self.occupancy[PIECE_COLOR[piece]] ^= bit
+        self.occupied ^= bit
+        self.key ^= zobrist.PIECE_KEYS[piece][sq]
+        self.score -= evaluation.PIECE_SQUARE[piece][sq]
+        self.phase -= evaluation.PIECE_PHASE[piece]
+        return piece
+
+    def move_piece(self, start, end):
+        """Moves the piece on start to the empty square end"""
+        self.put_piece(self.remove_piece(start), end)
 
     def get_pieces(self, color):
         if color == WHITE_ACTIVE:
@@ -143,14 +251,10 @@ class GameState:
             piece_set = BLACK_PIECES
 
         pieces = {}
-        for rank in range(8):
-            for column in range(8):
-                piece = self.board[rank, column]
-                if piece in piece_set:
-                    if piece in pieces:
-                        pieces[piece] += 1
-                    else:
-                        pieces[piece] = 1
+        for piece in piece_set:
+            count = bitboard.popcount(self.bitboards[piece])
+            if count:
+                pieces[piece] = count
         return pieces
     
     def get_opp_color(self):
@@ -161,16 +265,11 @@ class GameState:
         return opp_color
 
     def find_king(self, color):
-        if color == WHITE_ACTIVE:
-            for rank in range(7, -1, -1):
-                for column in range(8):
-                    if self.board[rank, column] == W_KING:
-                        return (rank, column)
-        elif color == BLACK_ACTIVE:
-            for rank in range(8):
-                for column in range(8):
-                    if self.board[rank, column] == B_KING:
-                        return (rank, column)
+        if color == WHITE_ACTIVE or color == BLACK_ACTIVE:
+            kings = self.bitboards[KING_MAP[color]]
+            if kings:
+                return bitboard.lsb(kings)
+            return None
         else:
             raise Exception("find_king: Invalid King Color")
 
@@ -182,42 +281,15 @@ class GameState:
         for rank in range(8):
             blank_count = 0
             for column in range(8):
-                if self.board[rank, column] in BLACK_PIECES:
-                    if blank_count != 0:
-                        fen_string += str(blank_count)
-                    # Reset blank count
-                    blank_count = 0
-                    if self.board[rank, column] == B_PAWN:
-                        fen_string += B_PAWN
-                    elif self.board[rank, column] == B_KNIGHT:
-                        fen_string += B_KNIGHT
-                    elif self.board[rank, column] == B_BISHOP:
-                        fen_string += B_BISHOP
-                    elif self.board[rank, column] == B_ROOK:
-                        fen_string += B_ROOK
-                    elif self.board[rank, column] == B_QUEEN:
-                        fen_string += B_QUEEN
-                    elif self.board[rank, column] == B_KING:
-                        fen_string += B_KING
-                elif self.board[rank, column] in WHITE_PIECES:
+                piece = self.squares[rank * 8 + column]
+                if piece == NO_PIECE:
+                    blank_count += 1
+                else:
                     if blank_count != 0:
                         fen_string += str(blank_count)
                     # Reset blank count
                     blank_count = 0
-                    if self.board[rank, column] == W_PAWN:
-                        fen_string += W_PAWN
-                    elif self.board[rank, column] == W_KNIGHT:
-                        fen_string += W_KNIGHT
-                    elif self.board[rank, column] == W_BISHOP:
-                        fen_string += W_BISHOP
-                    elif self.board[rank, column] == W_ROOK:
-                        fen_string += W_ROOK
-                    elif self.board[rank, column] == W_QUEEN:
-                        fen_string += W_QUEEN
-                    elif self.board[rank, column] == W_KING:
-                        fen_string += W_KING
-                else: # Blank space
-                    blank_count += 1
+                    fen_string += piece
             # Append blank count if there is one
             if blank_count != 0:
                 fen_string += str(blank_count)
@@ -225,17 +297,11 @@ class GameState:
             if rank != RANK_1:
                 fen_string += "/"
 
-        # Fix issue where en_passant can be a coord or "-"
-        if self.en_passant is tuple:
-            en_p_alg = coord_to_alg(self.en_passant)
-        else:
-            en_p_alg = self.en_passant
-
         # Finished with board, next is the rest
         fen_string += " {} {} {} {} {}".format(
             self.active_color,
             self.castles_avail,
-            en_p_alg,
+            square_to_alg(self.en_passant),
             str(self.halfmove),
             str(self.fullmove)
             )
@@ -257,6 +323,47 @@ class Action: # Lawsuit
         return "({0}, {1}, {2}, {3}, {4}, {5}, {6})\n".format(self.piece, self.start, self.end, self.capture, self.en_p, self.castle, self.promo)
 
 # Functions
+def encode_move(start, end, piece, captured=NO_PIECE, promo=NO_PIECE, flags=0):
+    """Packs a move into an int. start and end are square indices."""
+    return start | end << MOVE_END_SHIFT | PIECE_INDEX[piece] << MOVE_PIECE_SHIFT | \
+        PIECE_INDEX[captured] << MOVE_CAPTURE_SHIFT | PIECE_INDEX[promo] << MOVE_PROMO_SHIFT | flags
+
+def decode_move(move):
+    """Unpacks an encoded move into an Action"""
+    start = move & MOVE_SQUARE_MASK
+    end = (move >> MOVE_END_SHIFT) & MOVE_SQUARE_MASK
+    piece = INDEX_PIECE[(move >> MOVE_PIECE_SHIFT) & MOVE_PIECE_MASK]
+    if move & FLAG_CASTLE:
+        if end % 8 == FILE_G:
+            return Action(piece=piece, castle=CASTLE_KINGSIDE)
+        return Action(piece=piece, castle=CASTLE_QUEENSIDE)
+
+    promo = INDEX_PIECE[(move >> MOVE_PROMO_SHIFT) & MOVE_PIECE_MASK]
+    en_p = None
+    if move & FLAG_DOUBLE_PUSH:
+        en_p = bitboard.coord((start + end) // 2)
+    return Action(
+        piece,
+        bitboard.coord(start),
+        bitboard.coord(end),
+        capture=bool(move & MOVE_CAPTURE_MASK),
+        en_p=en_p,
+        promo=promo if promo != NO_PIECE else None
+        )
+
+def square_to_alg(sq):
+    """Returns the algebraic name of a square index, or - for None"""
+    if sq is None:
+        return NO_C_EP
+    return coord_to_alg(bitboard.coord(sq))
+
+def alg_to_square(alg):
+    """Returns the square index of an algebraic position, or None for -"""
+    coord = alg_to_coord(alg)
+    if coord is None:
+        return None
+    return bitboard.square(coord)
+
 def coord_to_alg(coord):
     """Turns a numerical coordinate tuple into the algebraic rank/file notation"""
     # Ensure the coordinates are on the board
@@ -0,0 +1,169 @@
+# Engine session kept for a whole game
+#
+# Holds the position and everything the search learns, from one move decision
+# to the next: the transposition table, the history, killer and countermove
+# tables and the last principal variation. Moves reported by the server are
+# played on the kept position instead of parsing the FEN again, so the key
+# stack covers the whole game. When the game follows the line the last search
+# predicted, the next search starts down the rest of that line.
+#
+# While the opponent thinks, the engine can ponder: search the position after
+# its move and the reply it expects, in a background thread, on a copy of the
+# state but with the same tables. The client only waits on the socket then, so
+# the thread has the interpreter to itself. If the opponent plays the expected
+# reply the search goes on from the ponder search's line and table entries,
+# otherwise the ponder search is stopped and only its table entries are left.
+#
+# With more than one thread, the transposition table lives in shared memory and
+# helper processes search alongside every move decision, see smp. With root
+# splitting, a pool of processes shares out the root moves instead, see
+# root_split.
+
+import threading
+
+from games.chess import chess_classes as cc
+from games.chess import history
+from games.chess import interface
+from games.chess import root_split
+from games.chess import search
+from games.chess import smp
+from games.chess import timing
+from games.chess import transposition
+
+
+class Engine:
+    """The position and search tables of one game"""
+    __slots__ = ['state', 'moves_played', 'history_table', 'transposition_table', 'smp', 'root_split', 'pv', 'ordering',
+                 'ponder_thread', 'ponder_state', 'ponder_pv', 'ponder_ordering', 'ponder_clock']
+    def __init__(self, fen, moves_played=0, tt_mb=transposition.DEFAULT_MB, threads=1, root_workers=0):
+        self.state               = interface.fen_to_GameState(fen)
+        self.moves_played        = moves_played   # Moves of the game history already played on the state
+        self.history_table       = history.HistoryTable()
+        self.smp                 = None           # Helper processes when searching with more than one thread
+        self.root_split          = None           # Process pool for the root moves when splitting the root
+        if threads > 1 and root_workers:
+            raise Exception("Engine: Use either more threads or root splitting, not both")
+        if threads > 1:
+            self.transposition_table = transposition.SharedTranspositionTable(tt_mb)
+            self.smp = smp.LazySMP(threads, self.transposition_table)
+        elif root_workers:
+            self.transposition_table = transposition.SharedTranspositionTable(tt_mb)
+            self.root_split = root_split.RootSplit(root_workers, self.transposition_table)
+        else:
+            self.transposition_table = transposition.TranspositionTable(tt_mb)
+        self.pv                  = search.PrincipalVariation()
+        self.ordering            = search.MoveOrdering()
+        self.ponder_thread       = None           # Background search while the opponent thinks, None when not pondering
+        self.ponder_state        = None           # Position being pondered, after the expected reply
+        self.ponder_pv           = None
+        self.ponder_ordering     = None
+        self.ponder_clock        = None           # Time manager without a limit, stopped by stop_pondering
+
+    def update(self, fen, game_history):
+        """Plays the moves added to the game history since the last update.
+        If they can't be followed to the FEN, starts again from the FEN with no
+        earlier positions and no predicted line.
+        """
+        new_moves = game_history[self.moves_played:]
+        self.moves_played = len(game_history)
+        for san_string in new_moves:
+            move = interface.san_to_move(self.state, san_string)
+            if move == cc.NO_MOVE:
+                break
+            self.play(move)
+        else:
+            # Board, side to move and castles have to agree with the server
+            if self.state.get_fen().split(' ')[:3] == fen.split(' ')[:3]:
+                return
+        print("Couldn't follow the game history, repetitions before now are unknown")
+        self.state = interface.fen_to_GameState(fen)
+        self.pv.advance(cc.NO_MOVE)
+        self.ordering.clear()
+
+    def play(self, move):
+        """Makes the move on the state and moves the search tables one ply along"""
+        search.make_move(self.state, move)
+        self.pv.advance(move)
+        self.ordering.advance()
+
+    def search(self, qs_depth, percentage, time_remaining):
+        """Searches the state for the share of the time remaining.
+        :return: list of (encoded move, value), one per depth searched
+        """
+        # Pondering already aged the tables for this move
+        if not self.stop_pondering():
+            # Age the Transposition Table so entries from old moves get replaced first
+            self.transposition_table.new_search()
+            # Age the History Table so the last move's scores count for less
+            self.history_table.age()
+        if self.smp:
+            return self.smp.search(self.state, qs_depth, self.history_table, self.pv, self.ordering, percentage, time_remaining)
+        if self.root_split:
+            return self.root_split.search(self.state, qs_depth, self.history_table, self.pv, self.ordering, percentage, time_remaining)
+        return search.tl_ht_qs_ab_id_dl_minimax(self.state, qs_depth, self.history_table, self.transposition_table, percentage, time_remaining, self.pv, self.ordering)
+
+    def start_pondering(self, move, qs_depth):
+        """Searches the position after the move and the reply the last search
+        expects in a background thread, until stop_pondering is called.
+        Does nothing if the last search's line doesn't start with the move.
+        """
+        self.stop_pondering()
+        line = self.pv.previous
+        if len(line) < 2 or line[0] != move:
+            return
+        state = self.state.copy()
+        search.make_move(state, line[0])
+        search.make_move(state, line[1])
+
+        self.ponder_state = state
+        self.ponder_pv = search.PrincipalVariation()
+        self.ponder_pv.previous = line[2:]
+        self.ponder_ordering = search.MoveOrdering()
+        self.ponder_clock = timing.TimeManager()
+        self.transposition_table.new_search()
+        self.history_table.age()
+        self.ponder_thread = threading.Thread(target=self.ponder, args=(qs_depth,), daemon=True)
+        self.ponder_thread.start()
+
+    def ponder(self, qs_depth):
+        """Iterative deepening on the pondered position until stopped"""
+        pv = self.ponder_pv
+        pv.new_search()
+        best_value = None
+        for depth in range(1, search.MAX_PLY):
+            _, value = search.aspiration_search(self.ponder_state, depth, qs_depth, self.ponder_clock, self.history_table,
+                                                self.transposition_table, pv, self.ponder_ordering, best_value)
+            if self.ponder_clock.stopped:
+                break
+            best_value = value
+            pv.new_iteration()
+
+    def stop_pondering(self):
+        """Stops the ponder search and waits for it.
+        Returns whether it was pondering the current position, in which case
+        its line and killers are taken over for the next search.
+        """
+        if self.ponder_thread is None:
+            return False
+        self.ponder_clock.stop()
+        self.ponder_thread.join()
+        hit = self.ponder_state.key == self.state.key
+        if hit:
+            self.pv = self.ponder_pv
+            self.ordering = self.ponder_ordering
+        self.ponder_thread = None
+        self.ponder_state = None
+        self.ponder_pv = None
+        self.ponder_ordering = None
+        self.ponder_clock = None
+        return hit
+
+    def close(self):
+        """Stops pondering and ends any helper processes. Call once the game is over."""
+        self.stop_pondering()
+        if self.smp:
+            self.smp.close()
+            self.smp = None
+        if self.root_split:
+            self.root_split.close()
+            self.root_split = None
@@ -1,348 +1,245 @@
 from games.chess import chess_classes as cc
+from games.chess import bitboard
+from games.chess import attacks
 from games.chess import check
 
-class Piece:
-    """Each Piece on the board"""
-    __slots__ = ['string', 'coord', 'color']
-    def __init__(self, string, coord):
-        self.string = string
-        self.coord = coord
-
-        if self.string in cc.BLACK_PIECES:
-            self.color = cc.BLACK_ACTIVE
-        elif string in cc.WHITE_PIECES:
-            self.color = cc.WHITE_ACTIVE
-        else:
-            self.color = None
-            raise Exception('Piece.__init__: Invalid Color')
-
-    def get_moves(self, state):
-        possible_moves = []
-        if self.string in cc.PAWN_SET:
-            possible_moves = self.get_pawn_moves(state)
-        elif self.string in cc.KNIGHT_SET:
-            possible_moves = self.get_knight_moves(state)
-        elif self.string in cc.BISHOP_SET:
-            possible_moves = get_bishop_moves(state, self.coord)
-        elif self.string in cc.ROOK_SET:
-            possible_moves = get_rook_moves(state, self.coord)
-        elif self.string in cc.QUEEN_SET:
-            possible_moves = get_queen_moves(state, self.coord)
-        elif self.string in cc.KING_SET:
-            possible_moves = self.get_king_moves(state)
-        return tuple(possible_moves)
-
-    def get_pawn_moves(self, state):
-        """Returns the moves for the pawn at the given location
-        """
-        pawn_moves = []
-
-        if self.color == cc.WHITE_ACTIVE:
-            forward_1 = add_vectors(self.coord, cc.V_UP)
-            forward_2 = add_vectors(self.coord, cc.V_UP_2)
-            attacks = get_crawler_moves(self.coord, cc.W_PAWN_CAPTURE_VECTORS)
-            starting_rank = cc.RANK_2
-            promo_rank = cc.RANK_8
-            promo_pieces = cc.WHITE_PROMO
-            enemy_set = cc.BLACK_PIECES
-        elif self.color == cc.BLACK_ACTIVE:
-            forward_1 = add_vectors(self.coord, cc.V_DOWN)
-            forward_2 = add_vectors(self.coord, cc.V_DOWN_2)
-            attacks = get_crawler_moves(self.coord, cc.B_PAWN_CAPTURE_VECTORS)
-            starting_rank = cc.RANK_7
-            promo_rank = cc.RANK_1
-            promo_pieces = cc.BLACK_PROMO
-            enemy_set = cc.WHITE_PIECES
-        else:
-            raise Exception("get_pawn_moves: Invalid Piece Color")
-
-        if validate_move(forward_1) and state.board[forward_1] == cc.NO_PIECE:
-            if forward_1[0] == promo_rank:
-                for p in promo_pieces:
-                    pawn_moves.append(cc.Action(self.string, self.coord, forward_1, promo=p))
-            else:
-                pawn_moves.append(cc.Action(self.string, self.coord, forward_1))
-            if self.coord[0] == starting_rank and validate_move(forward_2) and state.board[forward_2] == cc.NO_PIECE:
-                pawn_moves.append(cc.Action(self.string, self.coord, forward_2, en_p=forward_1))
-
-        for attack in attacks:
-            if state.board[attack] in enemy_set:
-                if attack[0] == promo_rank:
-                    for p in promo_pieces:
-                        pawn_moves.append(cc.Action(self.string, self.coord, attack, capture=True, promo=p))
-                else:
-                    pawn_moves.append(cc.Action(self.string, self.coord, attack, capture=True))
-            # Make sure Pawns can attack en_passant squares
-            elif attack == state.en_passant:
-                pawn_moves.append(cc.Action(self.string, self.coord, attack, capture=True))
-
-        return pawn_moves
-
-    def get_knight_moves(self, state):
-        """Returns the moves for the knight at the given location
-        """
-        knight_moves = []
-        if self.color == cc.WHITE_ACTIVE:
-            enemy_set = cc.BLACK_PIECES
-        elif self.color == cc.BLACK_ACTIVE:
-            enemy_set = cc.WHITE_PIECES
-        else:
-            raise Exception("get_knight_moves: Invalid Knight Color")
-
-        possible_moves = get_crawler_moves(self.coord, cc.KNIGHT_VECTORS)
-        for move in possible_moves:
-            if state.board[move] == cc.NO_PIECE:
-                knight_moves.append(cc.Action(self.string, self.coord, move))
-            elif state.board[move] in enemy_set:
-                knight_moves.append(cc.Action(self.string, self.coord, move, capture=True))
-
-        return knight_moves
-    
-    def get_king_moves(self, state):
-        """Returns the moves for the king at the given location.
-        Makes sure that the King doesn't put himself in check.
-        """
-        #king_moves = []
-        possible_moves = []
-        if self.color == cc.WHITE_ACTIVE:
-            enemy_color = cc.BLACK_ACTIVE
-            enemy_pieces = cc.BLACK_PIECES
-        elif self.color == cc.BLACK_ACTIVE:
-            enemy_color = cc.WHITE_ACTIVE
-            enemy_pieces = cc.WHITE_PIECES
-        else:
-            raise Exception("GameState: Invalid Active Color")
-
-        for vector in cc.KING_VECTORS:
-            rank = self.coord[0] + vector[0]
-            column = self.coord[1] + vector[1]
-            if rank in cc.VALID_RANKS and column in cc.VALID_RANKS:
-                if state.board[rank, column] == cc.NO_PIECE:
-                    possible_moves.append(cc.Action(self.string, self.coord, (rank, column)))
-                elif state.board[rank, column] in enemy_pieces:
-                    possible_moves.append(cc.Action(self.string, self.coord, (rank, column), capture=True))
-        
-        # # Iterate over list of king moves, removing ones that are under attack
-        # for move in possible_moves:
-        #     if not check.space_under_attack(state, move.end, enemy_color):
-        #         king_moves.append(move)
-
-        return possible_moves
-
-
-def get_castle(state):
-        """Returns available castling moves based on the board.
-            Return (kingside:T/F, queenside:T/F)
-        """
-        # TODO: Make sure the castling spaces aren't under attack
-        # Queenside: A through E, Kingside: E through H
-        q_rook = False
-        k_rook = False
-        q_space = False
-        k_space = False
-        king = False
-
-        if state.active_color == cc.WHITE_ACTIVE:
-            # Check through rank 1
-            rank = cc.RANK_1
-            # Check the state to see if castling is available
-            wk_avail = True if cc.W_KING in state.castles_avail else False
-            wq_avail = True if cc.W_QUEEN in state.castles_avail else False
-            if state.board[rank, cc.FILE_E] == cc.W_KING:
-                king = True
-            if wq_avail:
-                if state.board[rank, cc.FILE_A] == cc.W_ROOK:
-                    q_rook = True
-                if state.board[rank, cc.FILE_B] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_C] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_D] == cc.NO_PIECE and \
-                    not check.space_under_attack(state, (rank, cc.FILE_B), cc.BLACK_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_C), cc.BLACK_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_D), cc.BLACK_ACTIVE):
-                    q_space = True
-            if wk_avail:
-                if state.board[rank, cc.FILE_F] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_G] == cc.NO_PIECE and \
-                    not check.space_under_attack(state, (rank, cc.FILE_F), cc.BLACK_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_G), cc.BLACK_ACTIVE):
-                    k_space = True
-                if state.board[rank, cc.FILE_H] == cc.W_ROOK:
-                    k_rook = True
-
-            # Check the variables to see what castling is available
-            if wk_avail and wq_avail and q_rook and q_space and king and k_space and k_rook:
-                return (True, True)
-            elif wq_avail and q_rook and q_space and king:
-                return (False, True)
-            elif wk_avail and king and k_space and k_rook:
-                return (True, False)
-            else:
-                return (False, False)
-
-        elif state.active_color == cc.BLACK_ACTIVE:
-            # Loop through rank 8
-            rank = cc.RANK_8
-            # Check the state to see if castling is available
-            bk_avail = True if cc.B_KING in state.castles_avail else False
-            bq_avail = True if cc.B_QUEEN in state.castles_avail else False
-            if state.board[rank, cc.FILE_E] == cc.B_KING:
-                king = True
-            if bq_avail:
-                if state.board[rank, cc.FILE_A] == cc.B_ROOK:
-                    q_rook = True
-                if state.board[rank, cc.FILE_B] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_C] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_D] == cc.NO_PIECE and \
-                    not check.space_under_attack(state, (rank, cc.FILE_B), cc.WHITE_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_C), cc.WHITE_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_D), cc.WHITE_ACTIVE):
-                    q_space = True
-            if bk_avail:
-                if state.board[rank, cc.FILE_F] == cc.NO_PIECE and \
-                    state.board[rank, cc.FILE_G] == cc.NO_PIECE and \
-                    not check.space_under_attack(state, (rank, cc.FILE_F), cc.WHITE_ACTIVE) and \
-                    not check.space_under_attack(state, (rank, cc.FILE_G), cc.WHITE_ACTIVE):
-                    k_space = True
-                if state.board[rank, cc.FILE_H] == cc.B_ROOK:
-                    k_rook = True
-
-            # Check the variables to see what castling is available
-            if bk_avail and bq_avail and q_rook and q_space and king and k_space and k_rook:
-                return (True, True)
-            elif bq_avail and q_rook and q_space and king:
-                return (False, True)
-            elif bk_avail and king and k_space and k_rook:
-                return (True, False)
-            else:
-                return (False, False)
-        else:
-            raise Exception("castle_state: Invalid active color")
-
-def get_crawler_moves(coord, vectors):
-    """Returns a tuple of possible moves based on the starting position and the vectors.
-    Used for Knights, Pawns, and Kings"""
-    possible_moves = []
-    for vector in vectors:
-        try:
-            move = (coord[0]+vector[0], coord[1]+vector[1])
-        except TypeError as e:
-            print("coord: {}".format(coord))
-            print("vector: {}".format(vector))
-        if move[0] in cc.VALID_RANKS and move[1] in cc.VALID_RANKS:
-            possible_moves.append(move)
-    return tuple(possible_moves)
-
-def get_direction_moves(state, piece, coord, vector):
-    """Loops through the board in the direction specified.
-    Returns the moves possible in the direction. 
-    Used for Bishops, Rooks, and Queens.
+def get_moves(state, moves):
+    """Appends the encoded pseudo-legal moves of the active color to moves.
+    Castles are handled separately by get_castle_moves.
     """
-    actions = []
-    if state.active_color == cc.WHITE_ACTIVE:
-        # Loop
-        rank = coord[0] + vector[0]
-        column = coord[1] + vector[1]
-        while rank in cc.VALID_RANKS and column in cc.VALID_RANKS:
-            if state.board[rank, column] == cc.NO_PIECE:
-                actions.append(cc.Action(piece, coord, (rank,column)))
-            elif state.board[rank, column] in cc.BLACK_PIECES:
-                actions.append(cc.Action(piece, coord, (rank,column), capture=True))
-                break
-            else:
-                break
-            rank += vector[0]
-            column += vector[1]
-    elif state.active_color == cc.BLACK_ACTIVE:
-        # Loop
-        rank = coord[0] + vector[0]
-        column = coord[1] + vector[1]
-        while rank in cc.VALID_RANKS and column in cc.VALID_RANKS:
-            if state.board[rank, column] == cc.NO_PIECE:
-                actions.append(cc.Action(piece, coord, (rank,column)))
-            elif state.board[rank, column] in cc.WHITE_PIECES:
-                actions.append(cc.Action(piece, coord, (rank,column), capture=True))
-                break
-            else:
-                break
-            rank += vector[0]
-            column += vector[1]
-    else:
-        raise Exception("Invalid Active Color")
-    return actions
-
-def add_vectors(coord, vector):
-    """Add a vector to a coordinate and return the new coordinate."""
-    return tuple(c1+c2 for c1,c2 in zip(coord, vector))
-
-def get_bishop_moves(state, coord):
-    """Returns the moves for the bishop at the given location
+    color = state.active_color
+    if color != cc.WHITE_ACTIVE and color != cc.BLACK_ACTIVE:
+        raise Exception("get_moves: Invalid Active Color")
+    bitboards = state.bitboards
+
+    get_pawn_moves(state, moves, bitboards[cc.PAWN_MAP[color]], bitboard.FULL)
+    get_en_passant_moves(state, moves, False)
+    for sq in bitboard.iter_squares(bitboards[cc.KNIGHT_MAP[color]]):
+        add_target_moves(state, cc.KNIGHT_MAP[color], sq, attacks.KNIGHT_ATTACKS[sq], moves)
+    for sq in bitboard.iter_squares(bitboards[cc.BISHOP_MAP[color]]):
+        add_target_moves(state, cc.BISHOP_MAP[color], sq, attacks.bishop_attacks(sq, state.occupied), moves)
+    for sq in bitboard.iter_squares(bitboards[cc.ROOK_MAP[color]]):
+        add_target_moves(state, cc.ROOK_MAP[color], sq, attacks.rook_attacks(sq, state.occupied), moves)
+    for sq in bitboard.iter_squares(bitboards[cc.QUEEN_MAP[color]]):
+        add_target_moves(state, cc.QUEEN_MAP[color], sq, attacks.queen_attacks(sq, state.occupied), moves)
+    for sq in bitboard.iter_squares(bitboards[cc.KING_MAP[color]]):
+        add_target_moves(state, cc.KING_MAP[color], sq, attacks.KING_ATTACKS[sq], moves)
+    return moves
+
+def get_legal_moves(state, moves, captures_only=False):
+    """Appends only the legal moves of the active color to moves, castles included.
+    The checkers and pinned pieces are found once, then every piece's targets
+    are masked so that no move can leave the king in check.
+    With captures_only, only captures and promotions are appended.
     """
-    # Movement Options
-    # Diagonals
-    # no piece = add move, enemy = add move & break loop, friendly = break loop
-
-    bishop_moves = []        
-
-    if state.active_color == cc.WHITE_ACTIVE:
-        for vector in cc.BISHOP_VECTORS:
-            bishop_moves.extend(get_direction_moves(state, cc.W_BISHOP, coord, vector))
-            
-    elif state.active_color == cc.BLACK_ACTIVE:
-        for vector in cc.BISHOP_VECTORS:
-            bishop_moves.extend(get_direction_moves(state, cc.B_BISHOP, coord, vector))
+    color = state.active_color
+    if color != cc.WHITE_ACTIVE and color != cc.BLACK_ACTIVE:
+        raise Exception("get_legal_moves: Invalid Active Color")
+    bitboards = state.bitboards
+    occupied = state.occupied
+    king = state.active_king
+    checkers = check.attackers_bitboard(state, king, state.opp_color)
+    if captures_only:
+        capture_mask = state.occupancy[state.opp_color]
+        promo_rank = bitboard.RANK_8_BB if color == cc.WHITE_ACTIVE else bitboard.RANK_1_BB
     else:
-        raise Exception("GameState: Invalid Active Color")
-    return bishop_moves
-
-def get_rook_moves(state, coord):
-    """Returns the moves for the rook at the given location
-    """
-    rook_moves = []
-
-    if state.active_color == cc.WHITE_ACTIVE:
-        for vector in cc.ROOK_VECTORS:
-            rook_moves.extend(get_direction_moves(state, cc.W_ROOK, coord, vector))
-
-    elif state.active_color == cc.BLACK_ACTIVE:
-        for vector in cc.ROOK_VECTORS:
-            rook_moves.extend(get_direction_moves(state, cc.B_ROOK, coord, vector))
+        capture_mask = bitboard.FULL
+        promo_rank = bitboard.EMPTY
+
+    # King moves. Take the king off the board so it can't hide behind itself on a checking line.
+    targets = attacks.KING_ATTACKS[king] & (bitboard.FULL ^ state.occupancy[color]) & capture_mask
+    without_king = occupied ^ bitboard.SQUARE_BB[king]
+    for sq in bitboard.iter_squares(targets):
+        if check.attackers_bitboard(state, sq, state.opp_color, without_king):
+            targets ^= bitboard.SQUARE_BB[sq]
+    add_target_moves(state, cc.KING_MAP[color], king, targets, moves)
+
+    # Double check, only the king can move
+    if checkers & (checkers - 1):
+        return moves
+    if checkers:
+        # Capture the checker or block between it and the king
+        check_mask = checkers | attacks.BETWEEN[king][bitboard.lsb(checkers)]
     else:
-        raise Exception("GameState: Invalid Active Color")
-    return rook_moves
-
-def get_queen_moves(state, coord):
-    """Returns the moves for the queen at the given location
+        check_mask = bitboard.FULL
+        if not captures_only:
+            get_castle_moves(state, moves)
+
+    pinned = get_pinned(state, king, color)
+    line = attacks.LINE[king]
+
+    # Pawns can also promote by pushing onto an empty square
+    pawn_mask = check_mask & (capture_mask | promo_rank)
+    pawns = bitboards[cc.PAWN_MAP[color]]
+    get_pawn_moves(state, moves, pawns & ~pinned, pawn_mask)
+    for sq in bitboard.iter_squares(pawns & pinned):
+        get_pawn_moves(state, moves, bitboard.SQUARE_BB[sq], pawn_mask & line[sq])
+    get_en_passant_moves(state, moves, True)
+
+    check_mask &= capture_mask
+
+    # Pinned knights can never move, so they are skipped
+    for sq in bitboard.iter_squares(bitboards[cc.KNIGHT_MAP[color]] & ~pinned):
+        add_target_moves(state, cc.KNIGHT_MAP[color], sq, attacks.KNIGHT_ATTACKS[sq] & check_mask, moves)
+    for piece, slider_attacks in ((cc.BISHOP_MAP[color], attacks.bishop_attacks),
+                                  (cc.ROOK_MAP[color], attacks.rook_attacks),
+                                  (cc.QUEEN_MAP[color], attacks.queen_attacks)):
+        for sq in bitboard.iter_squares(bitboards[piece]):
+            targets = slider_attacks(sq, occupied) & check_mask
+            # Pinned sliders can only move along the pin
+            if pinned & bitboard.SQUARE_BB[sq]:
+                targets &= line[sq]
+            add_target_moves(state, piece, sq, targets, moves)
+    return moves
+
+def get_pinned(state, king, color):
+    """Returns a bitboard of the color's pieces pinned to its king on square king"""
+    opp_color = cc.OPP_COLOR[color]
+    bitboards = state.bitboards
+    queens = bitboards[cc.QUEEN_MAP[opp_color]]
+    # Enemy sliders lined up with the king on an empty board
+    snipers = attacks.rook_attacks(king, bitboard.EMPTY) & (bitboards[cc.ROOK_MAP[opp_color]] | queens)
+    snipers |= attacks.bishop_attacks(king, bitboard.EMPTY) & (bitboards[cc.BISHOP_MAP[opp_color]] | queens)
+
+    pinned = bitboard.EMPTY
+    for sniper in bitboard.iter_squares(snipers):
+        blockers = attacks.BETWEEN[king][sniper] & state.occupied
+        # Exactly one piece in the way, and it's ours
+        if blockers and not blockers & (blockers - 1) and blockers & state.occupancy[color]:
+            pinned |= blockers
+    return pinned
+
+def add_target_moves(state, piece, start, targets, moves):
+    """Appends a move from start to each target square.
+    Squares held by friendly pieces are skipped and enemy squares are captures.
+    """
+    squares = state.squares
+    base = start | cc.PIECE_INDEX[piece] << cc.MOVE_PIECE_SHIFT
+    targets &= bitboard.FULL ^ state.occupancy[state.active_color]
+    while targets:
+        low = targets & -targets
+        end = low.bit_length() - 1
+        targets ^= low
+        moves.append(base | end << cc.MOVE_END_SHIFT | cc.PIECE_INDEX[squares[end]] << cc.MOVE_CAPTURE_SHIFT)
+
+def get_pawn_moves(state, moves, pawns, target_mask):
+    """Appends the pushes and captures of the given pawns that land on target_mask.
+    The pawns are moved together a whole bitboard at a time. En passant is
+    handled by get_en_passant_moves.
     """
-    queen_moves = []
     if state.active_color == cc.WHITE_ACTIVE:
-        for vector in cc.QUEEN_VECTORS:
-            queen_moves.extend(get_direction_moves(state, cc.W_QUEEN, coord, vector))
+        forward = cc.V_UP
+        capture_vectors = cc.W_PAWN_CAPTURE_VECTORS
+        double_rank = bitboard.RANK_3_BB
+        promo_rank = bitboard.RANK_8_BB
+        promo_pieces = cc.WHITE_PROMO
     elif state.active_color == cc.BLACK_ACTIVE:
-        for vector in cc.QUEEN_VECTORS:
-            queen_moves.extend(get_direction_moves(state, cc.B_QUEEN, coord, vector))
+        forward = cc.V_DOWN
+        capture_vectors = cc.B_PAWN_CAPTURE_VECTORS
+        double_rank = bitboard.RANK_6_BB
+        promo_rank = bitboard.RANK_1_BB
+        promo_pieces = cc.BLACK_PROMO
     else:
-        raise Exception("GameState: Invalid Active Color")
-    return queen_moves
-
-
-def validate_moves(moves):
-    """Check if all the moves are on the board.
-    Returns a tuple of booleans that map to the moves. True if valid, False if invalid
+        raise Exception("get_pawn_moves: Invalid Piece Color")
+
+    squares = state.squares
+    pawn = cc.PAWN_MAP[state.active_color]
+    pawn_index = cc.PIECE_INDEX[pawn] << cc.MOVE_PIECE_SHIFT
+    empty = bitboard.FULL ^ state.occupied
+    enemies = state.occupancy[state.opp_color] & target_mask
+
+    # Pushes
+    delta = forward[0] * 8 + forward[1]
+    forward_1 = bitboard.shift(pawns, forward) & empty
+    forward_2 = bitboard.shift(forward_1 & double_rank, forward) & empty & target_mask
+    forward_1 &= target_mask
+    for end in bitboard.iter_squares(forward_1 & promo_rank):
+        for p in promo_pieces:
+            moves.append(cc.encode_move(end - delta, end, pawn, promo=p))
+    for end in bitboard.iter_squares(forward_1 & ~promo_rank):
+        moves.append((end - delta) | end << cc.MOVE_END_SHIFT | pawn_index)
+    for end in bitboard.iter_squares(forward_2):
+        moves.append((end - 2 * delta) | end << cc.MOVE_END_SHIFT | pawn_index | cc.FLAG_DOUBLE_PUSH)
+
+    # Captures
+    for vector in capture_vectors:
+        delta = vector[0] * 8 + vector[1]
+        captures = bitboard.shift(pawns, vector) & enemies
+        for end in bitboard.iter_squares(captures & promo_rank):
+            for p in promo_pieces:
+                moves.append(cc.encode_move(end - delta, end, pawn, squares[end], p))
+        for end in bitboard.iter_squares(captures & ~promo_rank):
+            moves.append((end - delta) | end << cc.MOVE_END_SHIFT | pawn_index | cc.PIECE_INDEX[squares[end]] << cc.MOVE_CAPTURE_SHIFT)
+
+def get_en_passant_moves(state, moves, legal):
+    """Appends the en passant captures available to the active color.
+    With legal set, captures that would leave the king in check are skipped.
+    Both pawns leave their squares at once, so this is checked by looking at
+    the king's attackers on the board as it would be after the capture.
     """
-    valid_coords = []
-    for move in moves:
-        if move[0] in cc.VALID_RANKS and move[1] in cc.VALID_RANKS:
-            valid_coords.append(True)
-        else:
-            valid_coords.append(False)
-    return tuple(valid_coords)
+    end = state.en_passant
+    if end is None:
+        return
+    pawn = cc.PAWN_MAP[state.active_color]
+    captured = cc.PAWN_MAP[state.opp_color]
+    # Our pawns that attack the en passant square sit where an enemy pawn on it would attack
+    pawns = attacks.PAWN_ATTACKS[state.opp_color][end] & state.bitboards[pawn]
+    for start in bitboard.iter_squares(pawns):
+        if legal:
+            captured_sq = start - start % 8 + end % 8
+            occupied = (state.occupied ^ bitboard.SQUARE_BB[start] ^ bitboard.SQUARE_BB[captured_sq]) | bitboard.SQUARE_BB[end]
+            if check.attackers_bitboard(state, state.active_king, state.opp_color, occupied):
+                continue
+        moves.append(cc.encode_move(start, end, pawn, captured, flags=cc.FLAG_EN_PASSANT))
 
-def validate_move(move):
-    """Check if a single move is on the board.
-    Returns boolean.
+def get_castle(state):
+    """Returns available castling moves based on the board.
+        Return (kingside:T/F, queenside:T/F)
+    The king can't castle out of check, or through or into an attacked square.
+    Queenside: A through E, Kingside: E through H
     """
-    if move[0] in cc.VALID_RANKS and move[1] in cc.VALID_RANKS:
-        valid = True
+    if state.active_color == cc.WHITE_ACTIVE:
+        # Check through rank 1
+        rank = cc.RANK_1
+        king_avail = cc.W_KING in state.castles_avail
+        queen_avail = cc.W_QUEEN in state.castles_avail
+    elif state.active_color == cc.BLACK_ACTIVE:
+        # Check through rank 8
+        rank = cc.RANK_8
+        king_avail = cc.B_KING in state.castles_avail
+        queen_avail = cc.B_QUEEN in state.castles_avail
     else:
-        valid = False
-    return valid
\ No newline at end of file
+        raise Exception("castle_state: Invalid active color")
+
+    squares = state.squares
+    start = rank * 8
+    rook = cc.ROOK_MAP[state.active_color]
+    enemy = state.opp_color
+    if not (king_avail or queen_avail) or squares[start + cc.FILE_E] != cc.KING_MAP[state.active_color]:
+        return (False, False)
+    if check.space_under_attack(state, start + cc.FILE_E, enemy):
+        return (False, False)
+
+    kingside = king_avail and squares[start + cc.FILE_H] == rook and \
+        squares[start + cc.FILE_F] == cc.NO_PIECE and \
+        squares[start + cc.FILE_G] == cc.NO_PIECE and \
+        not check.space_under_attack(state, start + cc.FILE_F, enemy) and \
+        not check.space_under_attack(state, start + cc.FILE_G, enemy)
+    # The B file only has to be empty, the king doesn't cross it
+    queenside = queen_avail and squares[start + cc.FILE_A] == rook and \
+        squares[start + cc.FILE_B] == cc.NO_PIECE and \
+        squares[start + cc.FILE_C] == cc.NO_PIECE and \
+        squares[start + cc.FILE_D] == cc.NO_PIECE and \
+        not check.space_under_attack(state, start + cc.FILE_C, enemy) and \
+        not check.space_under_attack(state, start + cc.FILE_D, enemy)
+    return (kingside, queenside)
+
+def get_castle_moves(state, moves):
+    """Appends the encoded castles available to the active color"""
+    castles = get_castle(state)
+    king = cc.KING_MAP[state.active_color]
+    start = state.active_king
+    if castles[0]: # Kingside Castle
+        moves.append(cc.encode_move(start, start + 2, king, flags=cc.FLAG_CASTLE))
+    if castles[1]: # Queenside Castle
+        moves.append(cc.encode_move(start, start - 2, king, flags=cc.FLAG_CASTLE))
@@ -0,0 +1,58 @@
+# History heuristic for ordering quiet moves
+#
+# A score for every (side to move, start square, end square), raised when a
+# quiet move causes a beta cut-off and lowered for the quiet moves searched
+# before it that didn't. The table has a fixed size, so it can be kept for a
+# whole game and aged between moves rather than growing with every position.
+
+from games.chess import chess_classes as cc
+
+########## CONSTANTS ##########
+# Scores stay within (-MAX_SCORE, MAX_SCORE)
+MAX_SCORE = 16384
+# Bonuses are capped so very deep searches don't swamp the table
+MAX_BONUS = 1600
+SIDE_OFFSET = {cc.WHITE_ACTIVE: 0, cc.BLACK_ACTIVE: 64 * 64}
+# Start and end squares of an encoded move, start in the low bits
+MOVE_SQUARES_MASK = 0xFFF
+
+
+class HistoryTable:
+    """Butterfly history table indexed by side, start square and end square"""
+    __slots__ = ['scores']
+    def __init__(self):
+        self.scores = [0] * (2 * 64 * 64)
+
+    def clear(self):
+        self.scores = [0] * (2 * 64 * 64)
+
+    def age(self):
+        """Halves every score, so older searches count for less"""
+        self.scores = [score // 2 for score in self.scores]
+
+    def get_score(self, color, move):
+        return self.scores[SIDE_OFFSET[color] + (move & MOVE_SQUARES_MASK)]
+
+    def update(self, color, move, bonus):
+        """Adds the bonus (or malus, if negative) to the move's score.
+        The more extreme the score already is, the less it moves towards the
+        limit, so scores never leave (-MAX_SCORE, MAX_SCORE).
+        """
+        index = SIDE_OFFSET[color] + (move & MOVE_SQUARES_MASK)
+        score = self.scores[index]
+        self.scores[index] = score + bonus - score * abs(bonus) // MAX_SCORE
+
+    def reward(self, color, move, tried, depth):
+        """Rewards the quiet move that caused a cut-off at the depth, and
+        penalises the quiet moves tried before it
+        """
+        bonus = min(depth * depth, MAX_BONUS)
+        self.update(color, move, bonus)
+        for other in tried:
+            self.update(color, other, -bonus)
+
+    def sort(self, color, moves):
+        """Sorts quiet moves by score, highest first"""
+        scores = self.scores
+        offset = SIDE_OFFSET[color]
+        moves.sort(key=lambda move: scores[offset + (move & MOVE_SQUARES_MASK)], reverse=True)
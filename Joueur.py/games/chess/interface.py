@@ -1,40 +1,49 @@
-import numpy as np
+import struct
 
 from games.chess.chess_classes import W_PAWN, W_KNIGHT, W_BISHOP, W_ROOK, W_QUEEN, W_KING, WHITE_PIECES
 from games.chess.chess_classes import B_PAWN, B_KNIGHT, B_BISHOP, B_ROOK, B_QUEEN, B_KING, BLACK_PIECES
 from games.chess.chess_classes import PIECES, MA_PAWN
 from games.chess.chess_classes import RANK_1, RANK_2, RANK_3, RANK_4, RANK_5, RANK_6, RANK_7, RANK_8
 from games.chess.chess_classes import FILE_A, FILE_B, FILE_C, FILE_D, FILE_E, FILE_F, FILE_G, FILE_H
-from games.chess.chess_classes import MAX_POS, MIN_POS, VALID_RANKS
+from games.chess.chess_classes import MAX_POS, MIN_POS, VALID_RANKS, VALID_A_RANKS
 from games.chess.chess_classes import CASTLE_KINGSIDE, CASTLE_QUEENSIDE
+from games.chess.chess_classes import NO_PIECE
 from games.chess.chess_classes import GameState, Action
 from games.chess.chess_classes import coord_to_alg
 from games.chess.chess_classes import alg_to_coord
+from games.chess.chess_classes import decode_move
+from games.chess.chess_classes import INDEX_PIECE, PIECE_INDEX, WHITE_ACTIVE, BLACK_ACTIVE, NO_C_EP
+from games.chess.chess_classes import square_to_alg
+from games.chess.chess_classes import FLAG_CASTLE, NO_MOVE
+from games.chess.get_moves import get_legal_moves
+
+# Letters a pawn can promote to, in SAN
+PROMO_LETTERS = {W_KNIGHT, W_BISHOP, W_ROOK, W_QUEEN}
+
+# Packed positions: 32 bytes of squares, two per byte, then the fields below
+PACKED_FIELDS = struct.Struct('<BBBHH') # White to move, castles, en passant square, halfmove, fullmove
+CASTLE_BITS = {"K": 1, "Q": 2, "k": 4, "q": 8}
+NO_SQUARE = 64
 
 
 def fen_to_GameState(fen):
-    """Takes fen string and returns the numpy array reflecting it.
+    """Takes fen string and returns the GameState reflecting it.
     """
     # split the FEN string up to help parse it
     split = fen.split(' ')
     first = split[0]  # the first part is always the board locations
     lines = first.split('/') # get each line of the board
-    board_2d_list = []
+    squares = []
 
     for line in (lines):
-        rank_list = []
         for char in line:
             try:
                 char_as_number = int(char)
                 # it is a number, so that many blank spaces
                 for _ in range(char_as_number):
-                    rank_list.append(' ')
+                    squares.append(NO_PIECE)
             except:
-                rank_list.append(char)
-        board_2d_list.append(rank_list)
-
-    dt = np.dtype(np.unicode_, 1) # Datatype for the numpy array
-    board = np.array(board_2d_list, dtype=dt) # Generate the numpy array
+                squares.append(char)
 
     active = split[1] # Get the active color
     castles = split[2] # Get the available castles
@@ -42,7 +51,28 @@ def fen_to_GameState(fen):
     halfmove = (split[4])
     fullmove = split[5]
 
-    return GameState(board, active, castles, en_passant, halfmove, fullmove)
+    return GameState(squares, active, castles, en_passant, halfmove, fullmove)
+
+def pack_position(state):
+    """Returns the state packed into 39 bytes, to send to another process.
+    Each square is its PIECE_INDEX in 4 bits, a8 first.
+    """
+    squares = state.squares
+    board = bytes(PIECE_INDEX[squares[sq]] << 4 | PIECE_INDEX[squares[sq + 1]] for sq in range(0, 64, 2))
+    castles = sum(CASTLE_BITS.get(castle, 0) for castle in state.castles_avail)
+    en_passant = NO_SQUARE if state.en_passant is None else state.en_passant
+    return board + PACKED_FIELDS.pack(state.active_color == WHITE_ACTIVE, castles, en_passant, state.halfmove, state.fullmove)
+
+def unpack_position(data):
+    """Returns the GameState of a position packed by pack_position"""
+    squares = []
+    for byte in data[:32]:
+        squares.append(INDEX_PIECE[byte >> 4])
+        squares.append(INDEX_PIECE[byte & 0xF])
+    white, castles, en_passant, halfmove, fullmove = PACKED_FIELDS.unpack_from(data, 32)
+    castles_avail = "".join(castle for castle in "KQkq" if castles & CASTLE_BITS[castle]) or NO_C_EP
+    active = WHITE_ACTIVE if white else BLACK_ACTIVE
+    return GameState(squares, active, castles_avail, square_to_alg(None if en_passant == NO_SQUARE else en_passant), halfmove, fullmove)
 
 def san(action):
     """ Returns SAN that represents the action.
@@ -82,46 +112,49 @@ def san(action):
             san += "x"
         # Append the ending position
         san += coord_to_alg(action.end)
+        # Append the promotion piece, always as the white letter
+        if action.promo:
+            san += action.promo.upper()
     return san
 
-# def san_to_action(san):
-#     """Returns the action tuple from the given SAN
-#     """
-#     if san == CASTLE_KINGSIDE:
-#         castle = CASTLE_KINGSIDE
-#         return Action(castle=castle)
-#     elif san == CASTLE_QUEENSIDE:
-#         castle = CASTLE_QUEENSIDE
-#         return Action(castle=castle)
-#     else:
-#         arr = list(san)
+def san_to_move(state, san_string):
+    """Returns the legal encoded move the SAN describes in the state, or NO_MOVE
+    if none or more than one does. Takes the long form san() writes (e2e4,
+    Nb1c3, e7xd8Q) as well as short SAN (e4, Nbd7, exd8=Q+, O-O).
+    """
+    text = san_string.strip().rstrip("+#!?").replace("=", "").replace("0", "O")
+    moves = get_legal_moves(state, [])
+    if text == CASTLE_KINGSIDE or text == CASTLE_QUEENSIDE:
+        for move in moves:
+            if move & FLAG_CASTLE and decode_move(move).castle == text:
+                return move
+        return NO_MOVE
+    if len(text) < 2:
+        return NO_MOVE
 
-#         # Get the piece making the move
-#         if arr[0] in PIECES and arr[1] not in VALID_RANKS:
-#             piece = arr[0]
-#             start_alg = arr[1]+arr[2]
-#             start = alg_to_coord(start_alg)
-#             # Is it a capture?
-#             if arr[3] == "x":
-#                 capture = True
-#                 end_alg = arr[4]+arr[5]
-#                 end = alg_to_coord(end_alg)
-#             else:
-#                 capture = False
-#                 end_alg = arr[3]+arr[4]
-#                 end = alg_to_coord(end_alg)
-#         else:
-#             piece = MA_PAWN
-#             start_alg = arr[0]+arr[1]
-#             start = alg_to_coord(start_alg)
-#             # Is it a capture?
-#             if arr[2] == "x":
-#                 capture = True
-#                 end_alg = arr[3]+arr[4]
-#                 end = alg_to_coord(end_alg)
-#             else:
-#                 capture = False
-#                 end_alg = arr[2]+arr[3]
-#                 end = alg_to_coord(end_alg)
+    # Promotion piece, after the end square
+    promo = None
+    if len(text) > 2 and text[-1].upper() in PROMO_LETTERS and text[-2] in VALID_A_RANKS:
+        promo = text[-1].upper()
+        text = text[:-1]
+    end = text[-2:]
+    # Piece letter, then whatever of the start square is given
+    rest = text[:-2].replace("x", "")
+    piece = W_PAWN
+    if rest and rest[0] in WHITE_PIECES:
+        piece = rest[0]
+        rest = rest[1:]
 
-#     return Action(piece, start, end, capture)
\ No newline at end of file
+    found = []
+    for move in moves:
+        action = decode_move(move)
+        if action.castle or action.piece.upper() != piece or coord_to_alg(action.end) != end:
+            continue
+        if (action.promo.upper() if action.promo else None) != promo:
+            continue
+        start = coord_to_alg(action.start)
+        if all(char in start for char in rest):
+            found.append(move)
+    if len(found) != 1:
+        return NO_MOVE
+    return found[0]
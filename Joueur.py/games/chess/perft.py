@@ -0,0 +1,178 @@
+# Perft: counts the leaf nodes of the move generation tree
+#
+# Used to check get_moves/check/make_move against known node counts and to time
+# the move generator. The suite also checks reading moves back from SAN. Run
+# from the Joueur.py directory:
+#   python3 -m games.chess.perft --suite
+#   python3 -m games.chess.perft "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1" -d 3 --divide
+#   python3 -m games.chess.perft --file ../FEN.txt -d 3
+
+import argparse
+import sys
+import time
+from urllib.parse import unquote
+
+from games.chess import chess_classes as cc
+from games.chess import interface
+from games.chess import search
+
+########## CONSTANTS ##########
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# (Name, FEN, Depth, Nodes) from the standard perft positions
+PERFT_SUITE = (
+    ("Start", START_FEN, 4, 197281),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 3, 97862),
+    ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 5, 674624),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 3, 9467),
+    ("Position 4 Mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1", 3, 9467),
+    ("Position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", 3, 62379),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", 3, 89890),
+)
+
+# (FEN, SAN as the server might send it, the move in this client's SAN or None for no move)
+SAN_SUITE = (
+    (START_FEN, "e4", "e2e4"),
+    (START_FEN, "Nf3", "Ng1f3"),
+    (START_FEN, "Ng1f3", "Ng1f3"),
+    (START_FEN, "e5", None),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", "dxe6", "d5xe6"),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", "O-O-O", "O-O-O"),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", "0-0+", "O-O"),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", "Nc3b5", "Nc3b5"),
+    ("4k3/8/8/8/8/8/8/1N1K1N2 w - - 0 1", "Nd2", None),
+    ("4k3/8/8/8/8/8/8/1N1K1N2 w - - 0 1", "Nbd2", "Nb1d2"),
+    ("4k3/8/8/8/8/8/8/1N1K1N2 w - - 0 1", "Nf1d2", "Nf1d2"),
+    ("1n5k/P7/8/8/8/8/8/K7 w - - 0 1", "a8=Q", "a7a8Q"),
+    ("1n5k/P7/8/8/8/8/8/K7 w - - 0 1", "a8N+", "a7a8N"),
+    ("1n5k/P7/8/8/8/8/8/K7 w - - 0 1", "axb8=R", "a7xb8R"),
+    ("1n5k/P7/8/8/8/8/8/K7 w - - 0 1", "a7xb8B", "a7xb8B"),
+    ("1n5k/P7/8/8/8/8/8/K7 w - - 0 1", "a8", None),
+)
+
+
+# Functions
+def perft(state, depth, check_legal=False):
+    """Returns the number of leaf nodes depth plies below the state.
+    With check_legal, every node also compares the legal move generator with
+    making and testing every pseudo-legal move, and raises on a mismatch.
+    """
+    moves = search.legal_actions(state)
+    if check_legal:
+        validated = search.validate_actions(state, search.actions(state))
+        if sorted(moves) != sorted(validated):
+            raise Exception("perft: Legal move mismatch in {}".format(state.get_fen()))
+    if depth == 1 and not check_legal:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        if depth == 1:
+            nodes += 1
+            continue
+        undo = search.make_move(state, move)
+        nodes += perft(state, depth - 1, check_legal)
+        search.unmake_move(state, undo)
+    return nodes
+
+def divide(state, depth, check_legal=False):
+    """Returns a list of (SAN, nodes) for every root move"""
+    results = []
+    for move in search.legal_actions(state):
+        undo = search.make_move(state, move)
+        if depth > 1:
+            nodes = perft(state, depth - 1, check_legal)
+        else:
+            nodes = 1
+        search.unmake_move(state, undo)
+        results.append((interface.san(cc.decode_move(move)), nodes))
+    return results
+
+def run_perft(fen, depth, show_divide=False, check_legal=False):
+    """Runs perft on the FEN and prints the node count and speed.
+    Returns the node count.
+    """
+    state = interface.fen_to_GameState(fen)
+    start_time = time.perf_counter()
+    if show_divide:
+        results = divide(state, depth, check_legal)
+        for san, nodes in sorted(results):
+            print("{:>8} {}".format(san, nodes))
+        nodes = sum(nodes for _, nodes in results)
+    else:
+        nodes = perft(state, depth, check_legal)
+    elapsed = time.perf_counter() - start_time
+
+    if state.get_fen() != fen:
+        raise Exception("perft: State not restored after unmake_move: {}".format(state.get_fen()))
+    print("{}\n  depth {}  nodes {}  time {:.2f}s  nps {:.0f}".format(fen, depth, nodes, elapsed, nodes / max(elapsed, 1e-9)))
+    return nodes
+
+def run_suite(check_legal=False):
+    """Runs the standard positions, returns True if every node count matches"""
+    passed = True
+    total_nodes = 0
+    start_time = time.perf_counter()
+    for name, fen, depth, expected in PERFT_SUITE:
+        print(name)
+        nodes = run_perft(fen, depth, check_legal=check_legal)
+        total_nodes += nodes
+        if nodes != expected:
+            print("  FAILED: expected {}".format(expected))
+            passed = False
+    elapsed = time.perf_counter() - start_time
+    print("{}: {} nodes in {:.2f}s, {:.0f} nps".format("PASSED" if passed else "FAILED", total_nodes, elapsed, total_nodes / max(elapsed, 1e-9)))
+    return passed
+
+def run_san_suite():
+    """Reads SAN_SUITE, and every legal move of the perft positions in this
+    client's SAN, back with san_to_move. Returns True if every move matches.
+    """
+    passed = True
+    cases = list(SAN_SUITE)
+    for _, fen, _, _ in PERFT_SUITE:
+        state = interface.fen_to_GameState(fen)
+        cases += [(fen, interface.san(cc.decode_move(move)), interface.san(cc.decode_move(move))) for move in search.legal_actions(state)]
+    for fen, san_string, expected in cases:
+        move = interface.san_to_move(interface.fen_to_GameState(fen), san_string)
+        found = interface.san(cc.decode_move(move)) if move != cc.NO_MOVE else None
+        if found != expected:
+            print("  SAN FAILED: {} in {} read as {}, expected {}".format(san_string, fen, found, expected))
+            passed = False
+    print("SAN {}: {} moves".format("PASSED" if passed else "FAILED", len(cases)))
+    return passed
+
+def read_fen_file(path):
+    """Returns the FENs in a file, one per line. URL encoded FENs (as in FEN.txt) are decoded."""
+    fens = []
+    with open(path) as fen_file:
+        for line in fen_file:
+            fen = unquote(line).strip()
+            if fen:
+                fens.append(fen)
+    return fens
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Counts move generation leaf nodes (perft) for chess positions.')
+    parser.add_argument('fen', nargs='?', default=None, help='the FEN to search, may be URL encoded. Defaults to the start position')
+    parser.add_argument('-d', '--depth', type=int, default=3, help='the number of plies to search')
+    parser.add_argument('--divide', action='store_true', help='print the node count under each root move')
+    parser.add_argument('--file', dest='fen_file', default=None, help='run every FEN in a file, one per line, e.g. FEN.txt')
+    parser.add_argument('--suite', action='store_true', help='run the standard positions and check their known node counts')
+    parser.add_argument('--check', action='store_true', help='also compare the legal move generator with make-and-test at every node')
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        passed = run_suite(args.check)
+        return 0 if run_san_suite() and passed else 1
+
+    if args.fen_file:
+        fens = read_fen_file(args.fen_file)
+    else:
+        fens = [unquote(args.fen) if args.fen else START_FEN]
+    for fen in fens:
+        run_perft(fen, args.depth, args.divide, args.check)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
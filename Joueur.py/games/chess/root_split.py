@@ -0,0 +1,179 @@
+# Root splitting: the root moves searched by a pool of processes
+#
+# The first root move is searched in this process with the full window, which
+# usually finds the best value. The other root moves go to a pool of worker
+# processes, forked once for the game. Each worker tries to prove its move is no
+# better than the best value so far with a null window, and searches it again
+# with the window narrowed to the latest best value if it is. The best value is
+# kept in shared memory, so every worker's window narrows as the others finish.
+# Positions are sent as the bytes from interface.pack_position, not pickled
+# states, and the transposition table is shared with the workers.
+
+import multiprocessing
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from math import inf as infinity
+
+from games.chess import chess_classes as cc
+from games.chess import history
+from games.chess import interface
+from games.chess import search
+from games.chess import timing
+from games.chess import transposition
+
+########## CONSTANTS ##########
+# Shallower iterations are searched in this process, they finish faster than a hand-off
+MIN_SPLIT_DEPTH = 3
+# Seconds between checks of the clock while waiting for the workers
+WAIT_SECONDS = 0.01
+
+# Set in each worker process by init_worker
+worker_table = None         # SharedTranspositionTable
+worker_alpha = None         # multiprocessing.Value of the best root value so far
+worker_stop_event = None    # multiprocessing.Event set when time runs out
+worker_history_table = None # History table kept by the worker for the game
+
+
+# Functions
+def init_worker(table, alpha, stop_event):
+    """Runs once in each worker process as it starts"""
+    global worker_table, worker_alpha, worker_stop_event, worker_history_table
+    worker_table = table
+    worker_alpha = alpha
+    worker_stop_event = stop_event
+    worker_history_table = history.HistoryTable()
+
+def search_move(position, keys, move, depth, qs_depth, generation, seed):
+    """Runs in a worker. Searches the root move of the packed position to the
+    depth, against the shared best value.
+    :return: (move, value, line from the move, nodes). value is None unless
+    the move beat the best value, and the search wasn't stopped.
+    """
+    state = interface.unpack_position(position)
+    state.keys = array('Q', keys).tolist()
+    state.root_keys = len(state.keys)
+    # A new generation is a new move decision, age the history like the main search does
+    if generation != worker_table.generation:
+        worker_history_table.age()
+        worker_table.generation = generation
+    random.seed(seed)
+    search.stats.reset()
+    clock = timing.TimeManager(stop_event=worker_stop_event)
+    pv = search.PrincipalVariation()
+    ordering = search.MoveOrdering()
+
+    search.make_move(state, move)
+    alpha = worker_alpha.value
+    # Prove the move is no better than the best so far
+    value = -search.negamax(state, depth - 1, qs_depth, -alpha - 1, -alpha, clock, worker_history_table, worker_table, pv, ordering, 1, move)
+    if value > alpha and not clock.stopped:
+        # Better, search it again from the latest best value
+        alpha = worker_alpha.value
+        value = -search.negamax(state, depth - 1, qs_depth, -infinity, -alpha, clock, worker_history_table, worker_table, pv, ordering, 1, move)
+    if clock.stopped or value <= alpha:
+        return (move, None, [], search.stats.total())
+    with worker_alpha.get_lock():
+        if value > worker_alpha.value:
+            worker_alpha.value = value
+    return (move, value, [move] + pv.table.get(1, []), search.stats.total())
+
+class RootSplit:
+    """A process pool that searches root moves for the whole game.
+    table has to be a SharedTranspositionTable, made before the pool.
+    """
+    __slots__ = ['table', 'alpha', 'stop_event', 'pool']
+    def __init__(self, workers, table):
+        context = multiprocessing.get_context("fork")
+        self.table      = table
+        self.alpha      = context.Value('i', 0)   # Best root value so far, shared with the workers
+        self.stop_event = context.Event()         # Set to cancel the running searches
+        self.pool       = ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                              initargs=(table, self.alpha, self.stop_event))
+        # Fork every worker now, before any other thread is started
+        list(self.pool.map(int, range(workers)))
+
+    def search(self, state, qs_depth, history_table, pv, ordering, percentage, time_remaining):
+        """Iterative deepening as tl_ht_qs_ab_id_dl_minimax, with each deep
+        enough iteration's root moves split over the pool.
+        :return: list of (encoded move, value), one per depth searched
+        """
+        return search.tl_ht_qs_ab_id_dl_minimax(state, qs_depth, history_table, self.table, percentage, time_remaining, pv, ordering, self.search_root)
+
+    def search_root(self, state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, guess=None):
+        """Searches one depth, taking the arguments of search.aspiration_search.
+        :return: (encoded move, value)
+        """
+        if depth < MIN_SPLIT_DEPTH:
+            return search.aspiration_search(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, guess)
+        return self.split_root(state, depth, qs_depth, clock, history_table, pv, ordering)
+
+    def split_root(self, state, depth, qs_depth, clock, history_table, pv, ordering):
+        """Searches the first root move here and the rest in the pool.
+        :return: (encoded move, value)
+        """
+        search.stats.nodes += 1
+        pv.clear(0)
+        state.root_keys = len(state.keys)
+        _, tt_move = self.table.lookup(state.key, depth, -infinity, infinity)
+        moves = search.legal_actions(state)
+        if search.shuffle_moves:
+            random.shuffle(moves)
+        first_moves = (pv.get_move(0, moves), tt_move)
+        moves = list(search.pick_moves(state, moves, first_moves, ordering, 0, cc.NO_MOVE, history_table))
+        if not moves:
+            return cc.NO_MOVE, -infinity
+
+        best_move = moves[0]
+        undo = search.make_move(state, best_move)
+        best_value = -search.negamax(state, depth - 1, qs_depth, -infinity, infinity, clock, history_table, self.table, pv, ordering, 1, best_move)
+        search.unmake_move(state, undo)
+        pv.following = False
+        if clock.stopped:
+            return best_move, -infinity
+        pv.update(0, best_move)
+
+        self.alpha.value = best_value
+        self.stop_event.clear()
+        position = interface.pack_position(state)
+        keys = array('Q', state.keys).tobytes()
+        try:
+            futures = [self.pool.submit(search_move, position, keys, move, depth, qs_depth, self.table.generation, random.getrandbits(32))
+                       for move in moves[1:]]
+        except BrokenProcessPool:
+            # A worker died, search the whole root here. The first move is in the table already.
+            print("Root split: the process pool is broken, searching the root here")
+            return search.ht_qs_ab_dl_minimax(state, depth, qs_depth, clock, history_table, self.table, pv, ordering)
+        pending = futures
+        while pending:
+            _, pending = wait(pending, timeout=WAIT_SECONDS)
+            if pending and clock.poll():
+                # Out of time, drop the moves not started and stop the rest
+                self.stop_event.set()
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                break
+
+        for future in futures:
+            if future.cancelled():
+                continue
+            try:
+                move, value, line, nodes = future.result()
+            except Exception as error:
+                # Counts as not searched
+                print("Root split: a worker failed: {!r}".format(error))
+                continue
+            search.stats.nodes += nodes
+            if value is not None and value > best_value:
+                best_move, best_value = move, value
+                pv.table[0] = line
+        if not clock.stopped:
+            self.table.store(state.key, depth, best_value, transposition.EXACT, best_move)
+        return best_move, best_value
+
+    def close(self):
+        """Ends the workers and frees the shared table"""
+        self.pool.shutdown()
+        self.table.close()
@@ -1,133 +1,228 @@
-import pickle
+import math
 import random
-import time
-from contextlib import contextmanager
 
-from anytree import NodeMixin
-
-from queue import Queue, PriorityQueue
 from math import inf as infinity
-from itertools import count
 
 from games.chess import chess_classes as cc
+from games.chess import bitboard
+from games.chess import zobrist
+from games.chess import evaluation
+from games.chess import transposition
+from games.chess import timing
 from games.chess import get_moves as gm
 from games.chess import check
-from games.chess import interface
-
-# Data Structure for the information in each node
-class NodeData:
-    # Constructor
-    def __init__(self, state, action, path_cost=0, heuristic=None):
-        self.state = state
-        self.action = action
-        self.heuristic = heuristic
-
-    # String Output Definition
-    def __str__(self):
-        return self.state.__str__() + "\n" + "Action: " + self.action + "\n" + "h(n): " + self.heuristic
-
-# Tree Node definition. Uses NodeMixin to add TreeNode properties
-class SearchNode(NodeData, NodeMixin):
-    __slots__ = ['state', 'action', 'path_cost', 'heuristic', 'parent', 'children']
-    def __init__(self, state, action, path_cost=0, heuristic=None, parent=None):
-        super().__init__(state, action, path_cost, heuristic)
-        self.parent = parent
-
-    # String Output Definition
-    def __str__(self):
-        return super().__str__() + "\n" + "Parent: " + self.parent
-
-    def __lt__(self, other):
-        return self.heuristic < other.heuristic
-
-def is_nonquiescent(actions):
-    """Returns a boolean as to whether the current state is a terminal.
-    Based on whether the actions available in the state are:
-        -Capture opponent’s piece
-        -Opponent put into Check TODO
-        -Promotion of a Pawn
+
+# Score for checkmating, bigger than any evaluation. A mate found ply plies
+# from the root scores MATE_SCORE - ply, so nearer mates score higher.
+MATE_SCORE = 100000
+# Aspiration windows. Half width of the first window in centipawns, the depth
+# to start using them, and the width past which the window is fully opened.
+ASPIRATION_WINDOW = 50
+ASPIRATION_DEPTH = 3
+ASPIRATION_MAX = 1000
+# Killer moves kept per ply, and the most plies a search can reach
+KILLER_SLOTS = 2
+MAX_PLY = 128
+# Scores at least this far from 0 are mates. Quiescence can go past MAX_PLY.
+MATE_BOUND = MATE_SCORE - 2 * MAX_PLY
+# Quiescence. Captures that can't bring the score within DELTA_MARGIN of alpha are skipped.
+DELTA_MARGIN = 200
+
+# Value of each piece index in a move, for capture ordering and delta pruning
+CAPTURE_VALUES = tuple(evaluation.MG_VALUES.get(piece.lower(), 0) for piece in cc.INDEX_PIECE)
+
+def _build_mvv_lva():
+    """Returns the capture ordering score of every (piece, captured) byte of a move.
+    Most Valuable Victim first, then Least Valuable Attacker.
     """
-    for action in actions:
-        if action.capture == True:
-            return True
-        if action.promo is not None:
-            return True
-    else:
-        return False
+    scores = []
+    for index in range(256):
+        piece = index & cc.MOVE_PIECE_MASK
+        captured = index >> 4
+        if piece < len(CAPTURE_VALUES) and captured < len(CAPTURE_VALUES):
+            scores.append(CAPTURE_VALUES[captured] * 16 - CAPTURE_VALUES[piece] // 100)
+        else:
+            scores.append(0)
+    return tuple(scores)
+
+# Indexed by (move >> MOVE_PIECE_SHIFT) & 0xFF, the moving and captured pieces
+MVV_LVA = _build_mvv_lva()
 
-def is_terminal(node):
-    """Returns a boolean as to whether the node is a terminal. AKA Draw or Checkmate
+# Shuffle moves before ordering them. Turned off for reproducible benchmarks.
+shuffle_moves = True
+
+# Forward pruning, set from the AI settings
+null_move = True           # Try passing the move to prove a node fails high
+null_move_reduction = 2    # Depth taken off the null move search, plus 1 for every 6 plies of depth
+late_move_reductions = True # Search quiet moves late in the order less deeply
+lmr_min_depth = 3          # Depth a node needs before its moves are reduced
+lmr_full_moves = 3         # Moves searched at full depth before reducing
+
+def _build_reductions():
+    """Returns the late move reduction for [depth][move number].
+    Grows with the log of both, so late moves in deep nodes lose the most.
     """
-    if is_checkmate(node.state):
+    table = [[0] * 64 for _ in range(64)]
+    for depth in range(1, 64):
+        for move_number in range(1, 64):
+            table[depth][move_number] = int(0.75 + math.log(depth) * math.log(move_number) / 2.25)
+    return table
+
+LMR_REDUCTIONS = _build_reductions()
+
+class SearchStats:
+    """Counters for the current search"""
+    __slots__ = ['nodes', 'qs_nodes', 'see_pruned', 'null_cutoffs', 'lmr_researches', 'depth', 'lines', 'elapsed']
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0          # Positions searched by negamax
+        self.qs_nodes = 0       # Positions searched by quiescence
+        self.see_pruned = 0     # Losing captures skipped by quiescence
+        self.null_cutoffs = 0   # Nodes cut off by a null move search
+        self.lmr_researches = 0 # Reduced moves searched again at full depth
+        self.depth = 0          # Deepest iteration finished
+        self.lines = []         # (depth, value, principal variation) of each iteration finished
+        self.elapsed = 0        # ns the iterative deepening took
+
+    def total(self):
+        return self.nodes + self.qs_nodes
+
+stats = SearchStats()
+
+class PrincipalVariation:
+    """The best line found from each ply of the current search, and the line
+    from the last finished iteration. While the search is still on that line its
+    moves are searched first.
+    """
+    __slots__ = ['table', 'previous', 'following']
+    def __init__(self):
+        self.table = {}         # Ply: best line of encoded moves from that ply
+        self.previous = []      # Line from the root found by the last iteration
+        self.following = False  # Is the search still on the previous line?
+
+    def new_iteration(self):
+        """Keeps the line just found and follows it from the root again"""
+        self.previous = self.line()
+        self.following = True
+
+    def new_search(self):
+        """Starts a search down whatever is left of the previous line"""
+        self.table = {}
+        self.following = bool(self.previous)
+
+    def advance(self, move):
+        """Drops the move played from the front of the previous line, or the
+        whole line if the game left it
+        """
+        if self.previous and self.previous[0] == move:
+            self.previous = self.previous[1:]
+        else:
+            self.previous = []
+
+    def line(self):
+        """Returns the best line from the root"""
+        return list(self.table.get(0, []))
+
+    def clear(self, ply):
+        self.table[ply] = []
+
+    def update(self, ply, move):
+        """Sets the ply's line to the move followed by the line under it"""
+        self.table[ply] = [move] + self.table.get(ply + 1, [])
+
+    def get_move(self, ply, moves):
+        """Returns the previous line's move for this ply while following it, or NO_MOVE"""
+        if self.following:
+            if ply < len(self.previous) and self.previous[ply] in moves:
+                return self.previous[ply]
+            self.following = False
+        return cc.NO_MOVE
+
+class MoveOrdering:
+    """Quiet moves that caused cut-offs in the current search.
+    Killers are kept per ply, since a refutation often works for the sibling
+    positions too. Countermoves are kept per previous move, by the piece that
+    made it and its end square.
+    """
+    __slots__ = ['killers', 'countermoves']
+    def __init__(self):
+        self.killers = [[cc.NO_MOVE] * KILLER_SLOTS for _ in range(MAX_PLY)]
+        self.countermoves = [cc.NO_MOVE] * (16 * 64)
+
+    def clear(self):
+        self.__init__()
+
+    def advance(self):
+        """Moves the killers one ply closer to the root, after a move is played"""
+        self.killers.pop(0)
+        self.killers.append([cc.NO_MOVE] * KILLER_SLOTS)
+
+    def add_killer(self, ply, move):
+        """Makes the move the ply's newest killer, pushing out the oldest"""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers.insert(0, move)
+            killers.pop()
+
+    def get_killers(self, ply):
+        return self.killers[ply]
+
+    def set_countermove(self, prev_move, move):
+        if prev_move:
+            self.countermoves[get_countermove_index(prev_move)] = move
+
+    def get_countermove(self, prev_move):
+        if prev_move:
+            return self.countermoves[get_countermove_index(prev_move)]
+        return cc.NO_MOVE
+
+def get_countermove_index(move):
+    """Returns the countermove table index of a move, by its piece and end square"""
+    return ((move >> cc.MOVE_PIECE_SHIFT) & cc.MOVE_PIECE_MASK) << 6 | (move >> cc.MOVE_END_SHIFT) & cc.MOVE_SQUARE_MASK
+
+def is_draw(state):
+    """Returns whether the state is drawn by the 50 move rule, insufficient
+    material or repetition. Stalemate is found by the search from the empty move
+    list it generates anyway.
+    """
+    # 50 move rule. 100, because 2 actions = 1 move. Checkmate on the last move still wins.
+    if state.halfmove >= 100 and not is_checkmate(state):
         return True
-    elif is_draw(node.state, node.state.history):
+    if is_insufficient_material(state):
         return True
-    else:
-        return False
+    return is_repetition(state)
 
-def is_draw(state, history):
-    # Insufficient Material
-    white_material = state.get_pieces(cc.WHITE_ACTIVE)
-    black_material = state.get_pieces(cc.BLACK_ACTIVE)
-    
-    # Black and White each only have their kings
-    if len(white_material) == 1 and len(black_material) == 1:
-        return True
-    # White only has King
-    if len(white_material) == 1:
-        if len(black_material) == 2 and cc.B_BISHOP in black_material:
-            if black_material[cc.B_BISHOP] == 1:
-                return True
-        elif len(black_material) == 2 and cc.B_KNIGHT in black_material:
-            if black_material[cc.B_KNIGHT] == 1:
-                return True
-        else:
-            return False
-    # Black only has King
-    elif len(black_material) == 1:
-        if len(white_material) == 2 and cc.W_BISHOP in white_material:
-            if white_material[cc.W_BISHOP] == 1:
+def is_insufficient_material(state):
+    """Returns whether neither color has the material to checkmate: kings and
+    at most one bishop or knight between them. The phase already counts the
+    knights, bishops, rooks and queens left as pieces come and go.
+    """
+    if state.phase > evaluation.PHASE_WEIGHTS["n"]:
+        return False
+    return not (state.bitboards[cc.W_PAWN] | state.bitboards[cc.B_PAWN])
+
+def is_repetition(state):
+    """Returns whether the position counts as repeated. Once inside the search
+    path is enough, as the side that repeated could do it again. Positions from
+    the game before the search root have to have happened twice, a threefold
+    repetition. Only positions since the last capture or pawn move can repeat,
+    so the halfmove clock limits how far back to look.
+    """
+    keys = state.keys
+    key = state.key
+    oldest = max(len(keys) - state.halfmove, 0)
+    count = 0
+    # Same color to move every other position
+    for index in range(len(keys) - 4, oldest - 1, -2):
+        if keys[index] == key:
+            if index >= state.root_keys:
                 return True
-        elif len(white_material) == 2 and cc.W_KNIGHT in white_material:
-            if white_material[cc.W_KNIGHT] == 1:
+            count += 1
+            if count == 2:
                 return True
-        else:
-            return False
-
-    # Stalemate. King not in check, no valid moves
-    king = state.find_king(state.active_color)
-    if not check.space_under_attack(state, king, state.opp_color):
-        # Check if there are any valid moves
-        p_actions = actions(state)
-        v_actions = validate_actions(state, p_actions)
-        if not v_actions:
-            return True
-    
-    # Three State Repetition Rule
-    if len(history) >= 8:
-        sev_action = history[-1] # Last move
-        six_action = history[-2] # 2nd to last
-        five_action = history[-3]
-        four_action = history[-4]
-        three_action = history[-5]
-        two_action   = history[-6]
-        one_action   = history[-7]
-        zero_action  = history[-8]
-        if zero_action == four_action and \
-            one_action == five_action and \
-            two_action == six_action and \
-            three_action == sev_action:
-            return True
-
-    # 50 move rule. 100, because 2 actions = 1 move
-    if len(history) >= 100:
-        for idx in range(-1, -101, -1):
-            # Pawn Move
-            if history[idx][0] not in cc.WHITE_PIECES:
-                return False
-            if "x" in history[idx]:
-                return False
-        return True
+    return False
 
 def is_checkmate(state):
     """Returns a boolean as to whether the active color's king is in checkmate.
@@ -135,8 +230,7 @@ def is_checkmate(state):
     in_check = check.space_under_attack(state, state.active_king, state.opp_color)
     if in_check:
         # Are there any valid moves?
-        p_actions = actions(state)
-        v_actions = validate_actions(state, p_actions)
+        v_actions = legal_actions(state)
         if not v_actions:
             return True
         else:
@@ -149,394 +243,593 @@ def validate_actions(state, possible_action_list):
     valid_action_list = []
     # Validate actions
     for action in possible_action_list:
-        new_state = result(state, action)
-        if check.space_under_attack(new_state, new_state.inactive_king, new_state.active_color):
-            continue
-        else:
+        undo = make_move(state, action)
+        in_check = check.space_under_attack(state, state.inactive_king, state.active_color)
+        unmake_move(state, undo)
+        if not in_check:
             valid_action_list.append(action)
 
     return valid_action_list
 
 def actions(state):
-    """Take GameState and find all the valid actions the player can take.
-    Structure of an Action Tuple:
-        - Piece: Piece Constant
-        - Previous Location (RANK, FILE)
-        - New Location (RANK, FILE)
-        - Capture? 1 otherwise 0
-        - Castling? 1 character following FEN, otherwise -
-        - Promotion? Indicates which piece the pawn becomes, otherwise -
+    """Take GameState and find all the pseudo-legal moves the player can take.
+    Moves are encoded ints, see the Move Encoding constants in chess_classes:
+        - Start and End Squares 0-63
+        - Piece moving
+        - Piece captured, if any
+        - Piece the pawn promotes to, if any
+        - Double pawn push, en passant and castle flags
     """
     action_list = []
 
-    if state.active_color == cc.WHITE_ACTIVE:
-        active_pieces = cc.WHITE_PIECES
-    elif state.active_color == cc.BLACK_ACTIVE:
-        active_pieces = cc.BLACK_PIECES
-    else:
+    if state.active_color != cc.WHITE_ACTIVE and state.active_color != cc.BLACK_ACTIVE:
         raise Exception("Actions: Invalid Active Color")
     # Check for states where castling can occur
-    castles = gm.get_castle(state)
-    if castles[0]: # Kingside Castle
-        action_list.append(cc.Action(piece=cc.W_KING, castle=cc.CASTLE_KINGSIDE))
-    if castles[1]: # Queenside Castle
-        action_list.append(cc.Action(piece=cc.W_KING, castle=cc.CASTLE_QUEENSIDE))
-
-    # Loop over the board, finding the moves for each piece
-    for rank in range(8):
-        for column in range(8):
-            if state.board[rank, column] in active_pieces:
-                p = gm.Piece(state.board[rank, column], (rank, column))
-                action_list.extend(p.get_moves(state))
-
-    # Handle En passant attacks
-    for action in action_list:
-        if action.end == state.en_passant:
-            action.capture = True
+    gm.get_castle_moves(state, action_list)
+    # Find the moves for each piece
+    gm.get_moves(state, action_list)
 
     return action_list
 
-def result(state, action):
-    """Returns the new GameState from the passed state after applying the action"""
-    # Faster than deepcopy
-    new_state = pickle.loads(pickle.dumps((state)))
+def legal_actions(state):
+    """Take GameState and find only the legal moves the player can take.
+    Same as validate_actions(state, actions(state)), without making every move.
+    """
+    return gm.get_legal_moves(state, [])
+
+def legal_captures(state):
+    """Returns only the legal captures and promotions"""
+    return gm.get_legal_moves(state, [], True)
 
-    if action.castle == None:
+def capture_exchange(state, move):
+    """Returns the static exchange value of a capture or promotion.
+    Taking a piece worth at least the capturer can't lose material, so the
+    exchange is only worked out when it might.
+    """
+    captured = CAPTURE_VALUES[(move >> cc.MOVE_CAPTURE_SHIFT) & cc.MOVE_PIECE_MASK]
+    if captured >= CAPTURE_VALUES[(move >> cc.MOVE_PIECE_SHIFT) & cc.MOVE_PIECE_MASK] and not move & cc.MOVE_PROMO_MASK:
+        return captured
+    return check.static_exchange(state, move)
+
+def mvv_lva(move):
+    """Capture ordering key of a move, highest first. Promotions add the new piece's value."""
+    return MVV_LVA[(move >> cc.MOVE_PIECE_SHIFT) & 0xFF] + CAPTURE_VALUES[(move >> cc.MOVE_PROMO_SHIFT) & cc.MOVE_PIECE_MASK] * 16
+
+def remove_castles(castles_avail, removed):
+    """Returns the castle availability string without the removed castles"""
+    for castle in removed:
+        castles_avail = castles_avail.replace(castle, '')
+    # If the string is empty, replace with a dash
+    if not castles_avail:
+        castles_avail = cc.NO_C_EP
+    return castles_avail
+
+# Castles lost when a piece moves from or to one of these squares
+CASTLE_SQUARES = {
+    bitboard.square((cc.RANK_1, cc.FILE_E)): cc.W_KING + cc.W_QUEEN,
+    bitboard.square((cc.RANK_1, cc.FILE_H)): cc.W_KING,
+    bitboard.square((cc.RANK_1, cc.FILE_A)): cc.W_QUEEN,
+    bitboard.square((cc.RANK_8, cc.FILE_E)): cc.B_KING + cc.B_QUEEN,
+    bitboard.square((cc.RANK_8, cc.FILE_H)): cc.B_KING,
+    bitboard.square((cc.RANK_8, cc.FILE_A)): cc.B_QUEEN,
+}
+
+def make_move(state, move):
+    """Applies the encoded move to the state in place.
+    Returns the undo record that unmake_move needs to take it back:
+        (Move, Castles, En Passant, Halfmove, Active King, Inactive King, Key)
+    """
+    undo = (move, state.castles_avail, state.en_passant, state.halfmove, state.active_king, state.inactive_king, state.key)
+    state.keys.append(state.key)
+    # Take the old castles and en passant out of the key
+    state.key ^= zobrist.castles_key(state.castles_avail) ^ zobrist.en_passant_key(state.en_passant)
+
+    start = move & cc.MOVE_SQUARE_MASK
+    end = (move >> cc.MOVE_END_SHIFT) & cc.MOVE_SQUARE_MASK
+
+    if move & cc.FLAG_CASTLE:
+        rook_start, rook_end = castle_rook_squares(end)
+        # Delete and Place King
+        state.move_piece(start, end)
+        # Delete and Place Rook
+        state.move_piece(rook_start, rook_end)
+        state.en_passant = None
+        state.halfmove += 1
+    else:
         # Attacking En passant pawn
-        if new_state.en_passant == action.end:
-            new_state.board[action.start] = cc.NO_PIECE
-            new_state.board[action.end] = action.piece
-            # Delete black pawn
-            if new_state.en_passant[0] == cc.RANK_6:
-                down = (action.end[0]+1, action.end[1])
-                new_state.board[down] = cc.NO_PIECE
-            # Delete white pawn
-            elif new_state.en_passant[0] == cc.RANK_3:
-                up = (action.end[0]-1, action.end[1])
-                new_state.board[up] = cc.NO_PIECE
-        # Default Case
+        if move & cc.FLAG_EN_PASSANT:
+            # Delete the pawn that moved past the en passant square, same rank as the start
+            state.remove_piece(start - start % 8 + end % 8)
+        # Delete the captured piece
+        elif move & cc.MOVE_CAPTURE_MASK:
+            state.remove_piece(end)
+        # Delete piece from the start
+        piece = state.remove_piece(start)
+        # Place piece at the end, promoting pawns
+        if move & cc.MOVE_PROMO_MASK:
+            state.put_piece(cc.INDEX_PIECE[(move >> cc.MOVE_PROMO_SHIFT) & cc.MOVE_PIECE_MASK], end)
         else:
-            # Delete piece from the start
-            new_state.board[action.start] = " "
-            # Place piece at the end
-            new_state.board[action.end] = action.piece
+            state.put_piece(piece, end)
 
         # Set en_passant space for a pawn moving 2
-        if action.en_p:
-            new_state.en_passant = cc.coord_to_alg(action.en_p)
+        if move & cc.FLAG_DOUBLE_PUSH:
+            state.en_passant = (start + end) // 2
         else:
-            new_state.en_passant = cc.NO_C_EP
-
-        # Remove castle availability if the rook or king move
-        if action.piece == cc.W_ROOK:
-            if action.start == (cc.RANK_1, cc.FILE_H):
-                new_state.castles_avail = new_state.castles_avail.replace('K', '')
-            elif action.start == (cc.RANK_1, cc.FILE_A):
-                new_state.castles_avail = new_state.castles_avail.replace('Q', '')
-        elif action.piece == cc.W_KING:
-            if action.start == (cc.RANK_1, cc.FILE_E):
-                new_state.castles_avail = new_state.castles_avail.replace('K', '')
-                new_state.castles_avail = new_state.castles_avail.replace('Q', '')
-        elif action.piece == cc.B_ROOK:
-            if action.start == (cc.RANK_8, cc.FILE_H):
-                new_state.castles_avail = new_state.castles_avail.replace('k', '')
-            elif action.start == (cc.RANK_8, cc.FILE_A):
-                new_state.castles_avail = new_state.castles_avail.replace('q', '')
-        elif action.piece == cc.B_KING:
-            if action.start == (cc.RANK_8, cc.FILE_E):
-                new_state.castles_avail = new_state.castles_avail.replace('k', '')
-                new_state.castles_avail = new_state.castles_avail.replace('q', '')
+            state.en_passant = None
 
         # Update the halfmove count
-        if action.capture or action.piece == cc.W_PAWN or action.piece == cc.B_PAWN:
-            new_state.halfmove = 0
+        if move & cc.MOVE_CAPTURE_MASK or piece in cc.PAWN_SET:
+            state.halfmove = 0
         else:
-            new_state.halfmove += 1
-        
-    else: # Castle Time
-        if action.castle == cc.CASTLE_QUEENSIDE:
-            if state.active_color == cc.WHITE_ACTIVE:
-                # Delete and Place Rook
-                new_state.board[cc.RANK_1, cc.FILE_A] = " "
-                new_state.board[cc.RANK_1, cc.FILE_D] = cc.W_ROOK
-                # Delete and Place King
-                new_state.board[cc.RANK_1, cc.FILE_E] = " "
-                new_state.board[cc.RANK_1, cc.FILE_C] = cc.W_KING
-                # Remove all White castling availability
-                new_state.castles_avail = new_state.castles_avail.replace('K','')
-                new_state.castles_avail = new_state.castles_avail.replace('Q','')
-                # If the string is empty, replace with a dash
-                if not new_state.castles_avail:
-                    new_state.castles_avail = cc.NO_C_EP
-            elif state.active_color == cc.BLACK_ACTIVE:
-                # Delete and Place Rook
-                new_state.board[cc.RANK_8, cc.FILE_A] = " "
-                new_state.board[cc.RANK_8, cc.FILE_D] = cc.B_ROOK
-                # Delete and Place King
-                new_state.board[cc.RANK_8, cc.FILE_E] = " "
-                new_state.board[cc.RANK_8, cc.FILE_C] = cc.B_KING
-                # Remove all Black castling availability
-                new_state.castles_avail = new_state.castles_avail.replace('k','')
-                new_state.castles_avail = new_state.castles_avail.replace('q','')
-                # If the string is empty, replace with a dash
-                if not new_state.castles_avail:
-                    new_state.castles_avail = cc.NO_C_EP
-
-        elif action.castle == cc.CASTLE_KINGSIDE:
-            if state.active_color == cc.WHITE_ACTIVE:
-                # Delete and Place Rook
-                new_state.board[cc.RANK_1, cc.FILE_H] = " "
-                new_state.board[cc.RANK_1, cc.FILE_F] = cc.W_ROOK
-                # Delete and Place King
-                new_state.board[cc.RANK_1, cc.FILE_E] = " "
-                new_state.board[cc.RANK_1, cc.FILE_G] = cc.W_KING
-                # Remove all White castling availability
-                new_state.castles_avail = new_state.castles_avail.replace('K','')
-                new_state.castles_avail = new_state.castles_avail.replace('Q','')
-                # If the string is empty, replace with a dash
-                if not new_state.castles_avail:
-                    new_state.castles_avail = cc.NO_C_EP
-            elif state.active_color == cc.BLACK_ACTIVE:
-                # Delete and Place Rook
-                new_state.board[cc.RANK_8, cc.FILE_H] = " "
-                new_state.board[cc.RANK_8, cc.FILE_F] = cc.B_ROOK
-                # Delete and Place King
-                new_state.board[cc.RANK_8, cc.FILE_E] = " "
-                new_state.board[cc.RANK_8, cc.FILE_G] = cc.B_KING
-                # Remove all Black castling availability
-                new_state.castles_avail = new_state.castles_avail.replace('k','')
-                new_state.castles_avail = new_state.castles_avail.replace('q','')
-                # If the string is empty, replace with a dash
-                if not new_state.castles_avail:
-                    new_state.castles_avail = cc.NO_C_EP
+            state.halfmove += 1
+
+    # Remove castle availability if the rook or king move, or a rook is captured
+    if start in CASTLE_SQUARES:
+        state.castles_avail = remove_castles(state.castles_avail, CASTLE_SQUARES[start])
+    if end in CASTLE_SQUARES:
+        state.castles_avail = remove_castles(state.castles_avail, CASTLE_SQUARES[end])
     
     # Update fullmove count
-    if new_state.active_color == cc.WHITE_ACTIVE:
-        new_state.active_color = cc.BLACK_ACTIVE
-        new_state.opp_color = cc.WHITE_ACTIVE
+    if state.active_color == cc.WHITE_ACTIVE:
+        state.active_color = cc.BLACK_ACTIVE
+        state.opp_color = cc.WHITE_ACTIVE
     else:
-        new_state.active_color = cc.WHITE_ACTIVE
-        new_state.opp_color = cc.BLACK_ACTIVE
-        new_state.fullmove += 1
+        state.active_color = cc.WHITE_ACTIVE
+        state.opp_color = cc.BLACK_ACTIVE
+        state.fullmove += 1
 
-    new_state.active_king = new_state.find_king(new_state.active_color)
-    new_state.inactive_king = new_state.find_king(new_state.opp_color)
+    state.active_king = state.find_king(state.active_color)
+    state.inactive_king = state.find_king(state.opp_color)
+    # Put the new castles and en passant into the key and flip the side to move
+    state.key ^= zobrist.castles_key(state.castles_avail) ^ zobrist.en_passant_key(state.en_passant) ^ zobrist.SIDE_KEY
 
-    return new_state
-
-def update_history_table(history_table, state, move):
-    string = get_history_string(state, move)
-    if string in history_table:
-        value = history_table[string]
-        value += 1
-        history_table[string] = value
-    else:
-        history_table[string] = 1
+    return undo
 
-def get_history_string(state, move):
-    state_string = state.get_fen()
-    move_string = interface.san(move)
-    return state_string+" "+move_string
+def unmake_move(state, undo):
+    """Takes back the move recorded in the undo record returned by make_move"""
+    move, castles_avail, en_passant, halfmove, active_king, inactive_king, key = undo
+    start = move & cc.MOVE_SQUARE_MASK
+    end = (move >> cc.MOVE_END_SHIFT) & cc.MOVE_SQUARE_MASK
 
-def history_table_sort(history_table, state, moves):
-    q = PriorityQueue()
-    unique = count()
-    sorted_moves = []
+    # Give the move back to the color that made it
+    if state.active_color == cc.WHITE_ACTIVE:
+        state.active_color = cc.BLACK_ACTIVE
+        state.opp_color = cc.WHITE_ACTIVE
+        state.fullmove -= 1
+    else:
+        state.active_color = cc.WHITE_ACTIVE
+        state.opp_color = cc.BLACK_ACTIVE
 
+    if move & cc.FLAG_CASTLE:
+        rook_start, rook_end = castle_rook_squares(end)
+        state.move_piece(end, start)
+        state.move_piece(rook_end, rook_start)
+    else:
+        # Take the piece back to the start, undoing any promotion
+        state.remove_piece(end)
+        state.put_piece(cc.INDEX_PIECE[(move >> cc.MOVE_PIECE_SHIFT) & cc.MOVE_PIECE_MASK], start)
+        if move & cc.MOVE_CAPTURE_MASK:
+            captured = cc.INDEX_PIECE[(move >> cc.MOVE_CAPTURE_SHIFT) & cc.MOVE_PIECE_MASK]
+            if move & cc.FLAG_EN_PASSANT:
+                state.put_piece(captured, start - start % 8 + end % 8)
+            else:
+                state.put_piece(captured, end)
+
+    state.castles_avail = castles_avail
+    state.en_passant = en_passant
+    state.halfmove = halfmove
+    state.active_king = active_king
+    state.inactive_king = inactive_king
+    state.key = key
+    state.keys.pop()
+
+def make_null_move(state):
+    """Passes the move to the other color in place.
+    Returns the undo record that unmake_null_move needs:
+        (En Passant, Halfmove, Key)
+    The halfmove clock restarts so repetitions aren't looked for across the pass.
+    """
+    undo = (state.en_passant, state.halfmove, state.key)
+    state.keys.append(state.key)
+    state.key ^= zobrist.en_passant_key(state.en_passant) ^ zobrist.SIDE_KEY
+    state.en_passant = None
+    state.halfmove = 0
+    state.active_color, state.opp_color = state.opp_color, state.active_color
+    state.active_king, state.inactive_king = state.inactive_king, state.active_king
+    return undo
+
+def unmake_null_move(state, undo):
+    """Takes back the pass recorded in the undo record returned by make_null_move"""
+    state.en_passant, state.halfmove, state.key = undo
+    state.keys.pop()
+    state.active_color, state.opp_color = state.opp_color, state.active_color
+    state.active_king, state.inactive_king = state.inactive_king, state.active_king
+
+def has_pieces(state, color):
+    """Returns whether the color has anything besides pawns and its king"""
+    bitboards = state.bitboards
+    return state.occupancy[color] != bitboards[cc.PAWN_MAP[color]] | bitboards[cc.KING_MAP[color]]
+
+def castle_rook_squares(king_end):
+    """Returns (rook start, rook end) squares for the castle that moves the king to king_end"""
+    rank_start = king_end - king_end % 8
+    if king_end % 8 == cc.FILE_G:
+        return rank_start + cc.FILE_H, rank_start + cc.FILE_F
+    else:
+        return rank_start + cc.FILE_A, rank_start + cc.FILE_D
+
+def pick_moves(state, moves, first_moves, ordering, ply, prev_move, history_table):
+    """Yields the moves best first, in stages:
+        the first_moves (principal variation and Transposition Table moves),
+        captures that don't lose material, best exchange first,
+        the killers for the ply, the countermove to prev_move,
+        quiet moves by history score,
+        captures that lose material.
+    Each stage is only sorted once the search gets to it, so a cut-off on an
+    early move skips the work.
+    """
+    yielded = []
+    for move in first_moves:
+        if move and move not in yielded and move in moves:
+            yielded.append(move)
+            yield move
+
+    # Captures and promotions
+    good = []
+    bad = []
+    quiets = []
     for move in moves:
-        # Concat the state and move strings
-        string = get_history_string(state, move)
-        if string in history_table:
-            priority = history_table[string]
+        if move in yielded:
+            continue
+        if move & (cc.MOVE_CAPTURE_MASK | cc.MOVE_PROMO_MASK):
+            value = capture_exchange(state, move)
+            if value >= 0:
+                good.append((value, mvv_lva(move), move))
+            else:
+                bad.append((value, mvv_lva(move), move))
         else:
-            priority = 0
-        q.put((priority, next(unique), move))
-
-    #Change priority queue back to a list of moves
-    for entry in q.queue:
-        sorted_moves.append(entry[2])
-    return sorted_moves
+            quiets.append(move)
+    good.sort(reverse=True)
+    for entry in good:
+        yield entry[2]
+
+    # Quiet moves that refuted other moves
+    for move in ordering.get_killers(ply) + [ordering.get_countermove(prev_move)]:
+        if move and move in quiets:
+            quiets.remove(move)
+            yield move
+
+    history_table.sort(state.active_color, quiets)
+    yield from quiets
+
+    bad.sort(reverse=True)
+    for entry in bad:
+        yield entry[2]
+
+def value_to_table(value, ply):
+    """Returns the value counted from the node instead of the root, for the
+    Transposition Table. A mate is the same number of plies away from the node
+    whichever path reached it.
+    """
+    if value >= MATE_BOUND:
+        return value + ply
+    if value <= -MATE_BOUND:
+        return value - ply
+    return value
+
+def value_from_table(value, ply):
+    """Returns a value from the Transposition Table counted from the root again"""
+    if value >= MATE_BOUND:
+        return value - ply
+    if value <= -MATE_BOUND:
+        return value + ply
+    return value
+
+def get_bound(value, alpha, beta):
+    """Returns the Transposition Table bound type of a value searched with the (alpha, beta) window"""
+    if value <= alpha:
+        return transposition.UPPER
+    elif value >= beta:
+        return transposition.LOWER
+    else:
+        return transposition.EXACT
 
-def tl_ht_qs_ab_id_dl_minimax(node, qs_depth, history_table, percentage, time_remaining):
+def tl_ht_qs_ab_id_dl_minimax(state, qs_depth, history_table, transposition_table, percentage, time_remaining, pv=None, ordering=None, root_search=None):
     """Time Limited, Alpha Beta Pruning, Iterative Deepening,
     Depth Limited MiniMax.
-    TODO:
-    - Use a generator with a time limit
+    Each depth after the first is searched with an aspiration window around
+    the last depth's value, and the last depth's principal variation first.
+    A pv and ordering kept from the last move carry its predicted line and
+    killers over, otherwise the search starts without them.
+    time_remaining is in nanoseconds, percentage the share of it to aim for.
+    A depth is only started if the time manager expects it to finish.
+    root_search searches one depth, with the arguments of aspiration_search,
+    which is the default.
     """
+    if root_search is None:
+        root_search = aspiration_search
     values = []
+    stats.reset()
+    if pv is None:
+        pv = PrincipalVariation()
+    if ordering is None:
+        ordering = MoveOrdering()
+    pv.new_search()
 
     # Handle a time limit
-    start_time = time.time()
-    seconds = int(time_remaining * percentage / 1000000000)
-    end_time = start_time + seconds
+    clock = timing.TimeManager(time_remaining, percentage)
     # Start Depth at 1, increase until time limit is reached
     depth = 1
-    
-    while time.time() < end_time:
-        values.append(ht_qs_ab_dl_minimax(node, depth, qs_depth, end_time, history_table))
+
+    while depth < MAX_PLY and clock.start_iteration():
+        iteration_start = clock.elapsed()
+        guess = values[-1][1] if values else None
+        best_move, best_value = root_search(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, guess)
+        if clock.stopped:
+            # Root moves searched before the stop can still count, see aspiration_search
+            if best_value > -infinity:
+                values.append((best_move, best_value))
+            break
+        values.append((best_move, best_value))
+        stats.depth = depth
+        stats.lines.append((depth, best_value, pv.line()))
+        clock.iteration_done(clock.elapsed() - iteration_start, best_move)
+        pv.new_iteration()
         depth += 1
+    stats.elapsed = clock.elapsed()
     return values
 
-def maxv(node, depth, qs_depth, alpha, beta, player, end_time, history_table):
-    """Max Player Logic"""
-    if (depth == 0 and qs_depth == 0) or is_terminal(node):
-        return heuristic(node.state, player)
-    
-    possible_actions = actions(node.state)
-    valid_actions = validate_actions(node.state, possible_actions)
-    nonquiescent = is_nonquiescent(valid_actions)
+def aspiration_search(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, guess=None):
+    """Searches the root with a window around the guessed value.
+    The window is widened on the side that failed and searched again until
+    the value lands inside it. Without a guess the window is (-inf, inf).
+    If the clock stops the search, the move only counts if its value is inside
+    the window or it is the last depth's best move, otherwise (NO_MOVE, -inf)
+    is returned.
+    :return: (encoded move, value)
+    """
+    if guess is None or depth < ASPIRATION_DEPTH or abs(guess) >= MATE_BOUND:
+        return ht_qs_ab_dl_minimax(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering)
+
+    # Re-searches follow the failed search's line, keep the last depth's move
+    previous_move = pv.previous[0] if pv.previous else cc.NO_MOVE
+    delta = ASPIRATION_WINDOW
+    alpha, beta = guess - delta, guess + delta
+    while True:
+        best_move, best_value = ht_qs_ab_dl_minimax(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, alpha, beta)
+        if clock.stopped:
+            # Outside the window the value is only a bound, no better than the last depth's
+            if not alpha < best_value < beta and best_move != previous_move:
+                return (cc.NO_MOVE, -infinity)
+            break
+        # Fail Low
+        if best_value <= alpha:
+            alpha = best_value - delta
+        # Fail High
+        elif best_value >= beta:
+            beta = best_value + delta
+        else:
+            break
+        delta *= 4
+        if delta > ASPIRATION_MAX:
+            alpha, beta = -infinity, infinity
+        # Search the same line first again
+        pv.new_iteration()
+    return (best_move, best_value)
+
+def negamax(state, depth, qs_depth, alpha, beta, clock, history_table, transposition_table, pv, ordering, ply, prev_move):
+    """Alpha Beta Negamax with Principal Variation Search.
+    Values are from the point of view of the color to move in the state, so the
+    same code plays both sides by negating the child's value. Each move is made
+    on the state in place when it is reached and taken back after its search.
+    """
+    pv.clear(ply)
+    if depth == 0:
+        return quiescence(state, alpha, beta, qs_depth, clock, ply)
+    stats.nodes += 1
+    if not stats.nodes & timing.POLL_MASK and clock.poll():
+        return 0
+    if is_draw(state):
+        return 0
+
+    # Transposition Table lookup
+    alpha_orig, beta_orig = alpha, beta
+    # Entries count mates from their own node, so compare them to the window counted the same way
+    tt_value, tt_move = transposition_table.lookup(state.key, depth, value_to_table(alpha, ply), value_to_table(beta, ply))
+    if tt_value is not None:
+        return value_from_table(tt_value, ply)
+
+    in_check = check.space_under_attack(state, state.active_king, state.opp_color)
+    # Null move pruning. If passing still fails high the position is good enough
+    # that a real move will too. Not when the window is open (a PV node), right
+    # after another null move, in check, or with only pawns left, where passing
+    # can be better than any move (zugzwang).
+    if null_move and depth >= 2 and beta - alpha == 1 and prev_move != cc.NO_MOVE and not in_check and \
+            has_pieces(state, state.active_color) and heuristic(state, state.active_color) >= beta:
+        reduction = null_move_reduction + depth // 6
+        undo = make_null_move(state)
+        value = -negamax(state, max(depth - 1 - reduction, 0), qs_depth, -beta, -beta + 1, clock, history_table, transposition_table, pv, ordering, ply + 1, cc.NO_MOVE)
+        unmake_null_move(state, undo)
+        if value >= beta:
+            stats.null_cutoffs += 1
+            # Don't trust a mate found by passing
+            return beta if value >= MATE_BOUND else value
     
-    if depth == 0 and not nonquiescent:
-        return heuristic(node.state, player)
+    valid_actions = legal_actions(state)
+    # Checkmate or stalemate
+    if not valid_actions:
+        return ply - MATE_SCORE if in_check else 0
 
     # Randomize Moves
-    random.shuffle(valid_actions)
-    # History Table Sort
-    valid_actions = history_table_sort(history_table, node.state, valid_actions)
+    if shuffle_moves:
+        random.shuffle(valid_actions)
+    # The last iteration's principal variation, then the Transposition Table's best move
+    first_moves = (pv.get_move(ply, valid_actions), tt_move)
 
     best_value = -infinity
     best_move = None
-    if valid_actions:
-        best_move = valid_actions[0]
-
-    frontier = Queue()
-
-    for action in valid_actions:
-        frontier.put(
-            SearchNode(
-                result(node.state, action),
-                action
-            )
-        )
-
-    while not frontier.empty():
-        new_node = frontier.get()
-        # Recursive call
-        if depth == 0 and nonquiescent:
-            value = minv(new_node, depth, qs_depth-1, alpha, beta, player, end_time, history_table)
+    timed_out = False
+    # Quiet moves searched without a cut-off
+    tried_quiets = []
+    move_number = 0
+
+    for action in pick_moves(state, valid_actions, first_moves, ordering, ply, prev_move, history_table):
+        move_number += 1
+        quiet = not action & (cc.MOVE_CAPTURE_MASK | cc.MOVE_PROMO_MASK)
+        undo = make_move(state, action)
+        if best_move is None:
+            value = -negamax(state, depth - 1, qs_depth, -beta, -alpha, clock, history_table, transposition_table, pv, ordering, ply + 1, action)
+            pv.following = False
         else:
-            value = minv(new_node, depth-1, qs_depth, alpha, beta, player, end_time, history_table)
+            # Late move reductions. Quiet moves this far down the order rarely
+            # matter, so search them less deeply, unless they give check.
+            reduction = 0
+            if late_move_reductions and quiet and depth >= lmr_min_depth and move_number > lmr_full_moves and not in_check and \
+                    not check.space_under_attack(state, state.active_king, state.opp_color):
+                reduction = min(LMR_REDUCTIONS[min(depth, 63)][min(move_number, 63)], depth - 2)
+            # Prove the move is no better than alpha with a null window
+            value = -negamax(state, depth - 1 - reduction, qs_depth, -alpha - 1, -alpha, clock, history_table, transposition_table, pv, ordering, ply + 1, action)
+            # A reduced move that beats alpha gets the full depth
+            if reduction > 0 and value > alpha:
+                stats.lmr_researches += 1
+                value = -negamax(state, depth - 1, qs_depth, -alpha - 1, -alpha, clock, history_table, transposition_table, pv, ordering, ply + 1, action)
+            # It might be, search it again with the full window
+            if alpha < value < beta:
+                value = -negamax(state, depth - 1, qs_depth, -beta, -alpha, clock, history_table, transposition_table, pv, ordering, ply + 1, action)
+        unmake_move(state, undo)
         # Check if the time has expired
-        if time.time() > end_time:
+        if clock.stopped:
+            timed_out = True
             break
         # If the value is better than the previous best, replace it
         if value > best_value:
             best_value = value
-            best_move = new_node.action
+            best_move = action
+            pv.update(ply, best_move)
         # If the new best is better than alpha, set alpha to it
         if best_value > alpha:
             alpha = best_value
         # Fail High
         if alpha >= beta:
+            # Remember quiet moves that refute for the sibling positions
+            if quiet:
+                ordering.add_killer(ply, action)
+                ordering.set_countermove(prev_move, action)
+                history_table.reward(state.active_color, action, tried_quiets, depth)
             break
+        if quiet:
+            tried_quiets.append(action)
 
-    if best_move:
-        update_history_table(history_table, node.state, best_move)
+    if not timed_out:
+        transposition_table.store(state.key, depth, value_to_table(best_value, ply), get_bound(best_value, alpha_orig, beta_orig), best_move)
     
     return best_value
-    
 
-def minv(node, depth, qs_depth, alpha, beta, player, end_time, history_table):
-    """Min Player Logic"""
-    if depth == 0 or is_terminal(node):
-        return heuristic(node.state, player)
-    
-    possible_actions = actions(node.state)
-    valid_actions = validate_actions(node.state, possible_actions)
-    nonquiescent = is_nonquiescent(valid_actions)
-    
-    if depth == 0 and not nonquiescent:
-        return heuristic(node.state, player)
-
-    # Randomize Moves
-    random.shuffle(valid_actions)
-    # History Table Sort
-    valid_actions = history_table_sort(history_table, node.state, valid_actions)
-
-    best_value = +infinity
-    best_move = None
-    if valid_actions:
-        best_move = valid_actions[0]
-
-    frontier = Queue()
+def quiescence(state, alpha, beta, qs_depth, clock, ply):
+    """Searches only captures and promotions until the position is quiet.
+    The color to move can stand pat on the static evaluation instead of
+    capturing, so that is a lower bound. In check every evasion is searched
+    and there is no standing pat. qs_depth limits how many plies deep it goes,
+    ply is the distance from the root, for mate scores.
+    """
+    stats.qs_nodes += 1
+    if not stats.qs_nodes & timing.POLL_MASK and clock.poll():
+        return 0
+    in_check = check.space_under_attack(state, state.active_king, state.opp_color)
+    if in_check:
+        valid_actions = legal_actions(state)
+        if not valid_actions:
+            return ply - MATE_SCORE
+        if qs_depth == 0:
+            return heuristic(state, state.active_color)
+        stand_pat = -infinity
+    else:
+        stand_pat = heuristic(state, state.active_color)
+        if stand_pat >= beta or qs_depth == 0:
+            return stand_pat
+        # Not even winning a queen would catch up
+        if stand_pat + CAPTURE_VALUES[cc.PIECE_INDEX[cc.W_QUEEN]] + DELTA_MARGIN < alpha:
+            return stand_pat
+        valid_actions = legal_captures(state)
+
+    if stand_pat > alpha:
+        alpha = stand_pat
+    best_value = stand_pat
+    valid_actions.sort(key=mvv_lva, reverse=True)
 
     for action in valid_actions:
-        frontier.put(
-            SearchNode(
-                result(node.state, action),
-                action
-            )
-        )
-
-    while not frontier.empty():
-        new_node = frontier.get()
-        # Recursive call
-        if depth == 0 and nonquiescent:
-            value = maxv(new_node, depth, qs_depth-1, alpha, beta, player, end_time, history_table)
-        else:
-            value = maxv(new_node, depth-1, qs_depth, alpha, beta, player, end_time, history_table)
-        # Check if the time has expired
-        if time.time() > end_time:
-            break
-        # If the value is better than the previous best, replace it
-        if value < best_value:
+        if not in_check:
+            # Delta pruning, skip captures that can't raise the score to alpha
+            if not action & cc.MOVE_PROMO_MASK and \
+                    stand_pat + CAPTURE_VALUES[(action >> cc.MOVE_CAPTURE_SHIFT) & cc.MOVE_PIECE_MASK] + DELTA_MARGIN <= alpha:
+                continue
+            # Skip captures that lose material once the recaptures are done
+            if capture_exchange(state, action) < 0:
+                stats.see_pruned += 1
+                continue
+        undo = make_move(state, action)
+        value = -quiescence(state, -beta, -alpha, qs_depth - 1, clock, ply + 1)
+        unmake_move(state, undo)
+        if value > best_value:
             best_value = value
-            best_move = new_node.action
-        # If the new best is lower than beta, set beta to it
-        if best_value < beta:
-            beta = best_value
-        # Fail Low
-        if beta <= alpha:
-            break
-
-    if best_move:
-        update_history_table(history_table, node.state, best_move)
-
+            if value > alpha:
+                alpha = value
+                # Fail High
+                if alpha >= beta:
+                    break
     return best_value
-    
 
-def ht_qs_ab_dl_minimax(node, depth, qs_depth, end_time, history_table):
+def ht_qs_ab_dl_minimax(state, depth, qs_depth, clock, history_table, transposition_table, pv, ordering, alpha=-infinity, beta=infinity):
     """AI function that finds the best move to make.
-    :return: Action object
+    :return: (encoded move, value)
     """
 
-    alpha, beta = -infinity, infinity
-    player = node.state.active_color
+    alpha_orig, beta_orig = alpha, beta
+    stats.nodes += 1
+    pv.clear(0)
+    # Positions from here on are the search path, see is_repetition
+    state.root_keys = len(state.keys)
+    # Only the move is used, for ordering. The root always searches its moves.
+    _, tt_move = transposition_table.lookup(state.key, depth, alpha, beta)
 
-    possible_actions = actions(node.state)
-    valid_actions = validate_actions(node.state, possible_actions)
+    valid_actions = legal_actions(state)
     
     # Randomize Moves
-    random.shuffle(valid_actions)
-    # History Table Sort
-    valid_actions = history_table_sort(history_table, node.state, valid_actions)
+    if shuffle_moves:
+        random.shuffle(valid_actions)
+    # The last iteration's best move, then the Transposition Table's
+    first_moves = (pv.get_move(0, valid_actions), tt_move)
+    valid_actions = list(pick_moves(state, valid_actions, first_moves, ordering, 0, cc.NO_MOVE, history_table))
 
     best_value = -infinity
+    best_move = cc.NO_MOVE
     if valid_actions:
         best_move = valid_actions[0]
     
-    frontier = Queue()
-
+    timed_out = False
+    first = True
     for action in valid_actions:
-        frontier.put(
-            SearchNode(
-                result(node.state, action),
-                action
-            )
-        )
-    
-    while not frontier.empty():
-        new_node = frontier.get()
         # Recursive call
-        value = minv(new_node, depth-1, qs_depth, alpha, beta, player, end_time, history_table)
+        undo = make_move(state, action)
+        if first:
+            value = -negamax(state, depth-1, qs_depth, -beta, -alpha, clock, history_table, transposition_table, pv, ordering, 1, action)
+            first = False
+            pv.following = False
+        else:
+            value = -negamax(state, depth-1, qs_depth, -alpha - 1, -alpha, clock, history_table, transposition_table, pv, ordering, 1, action)
+            if alpha < value < beta:
+                value = -negamax(state, depth-1, qs_depth, -beta, -alpha, clock, history_table, transposition_table, pv, ordering, 1, action)
+        unmake_move(state, undo)
         
         # Check if the time has expired
-        if time.time() > end_time:
+        if clock.stopped:
+            timed_out = True
             break
         # If the value is better than the previous best, replace it
         if value > best_value:
             best_value = value
-            best_move = new_node.action
+            best_move = action
+            pv.update(0, best_move)
         # If the new best is better than alpha, set alpha to it
         if best_value > alpha:
             alpha = best_value
@@ -544,60 +837,17 @@ def ht_qs_ab_dl_minimax(node, depth, qs_depth, end_time, history_table):
         if alpha >= beta:
             break
     
-    update_history_table(history_table, node.state, best_move)
+    if not timed_out:
+        transposition_table.store(state.key, depth, best_value, get_bound(best_value, alpha_orig, beta_orig), best_move)
     return (best_move, best_value)
 
 
 def heuristic(state, player):
-    """Interface Logic for the heuristic
+    """Returns the tapered material and piece-square score for the player.
+    Read from the totals the state keeps up to date, so it doesn't look at
+    the board or the moves. Checkmate and draws are found by the search.
     """
-    if is_checkmate(state):
-        if state.active_color == cc.WHITE_ACTIVE:
-            return -9999
-        else:
-            return 9999
-    else:
-        return material_advantage(state, player)
-
-def material_advantage(state, player):
-    """Returns a number that reflects the material advantage of the passed color"""
-    ma = 0
+    value = evaluation.evaluate(state.score, state.phase)
     if player == cc.WHITE_ACTIVE:
-        white_factor = 1
-        black_factor = -1
-    else:
-        white_factor = -1
-        black_factor = 1
-    
-    for rank in range(8):
-        for column in range(8):
-            piece = state.board[rank, column]
-            if piece == cc.NO_PIECE:
-                continue
-            elif piece in cc.WHITE_PIECES:
-                if piece == cc.W_PAWN:
-                    ma += white_factor * cc.MA_PAWN
-                elif piece == cc.W_KNIGHT:
-                    ma += white_factor * cc.MA_KNIGHT
-                elif piece == cc.W_BISHOP:
-                    ma += white_factor * cc.MA_BISHOP
-                elif piece == cc.W_ROOK:
-                    ma += white_factor * cc.MA_ROOK
-                elif piece == cc.W_QUEEN:
-                    ma += white_factor * cc.MA_QUEEN
-                elif piece == cc.W_KING:
-                    ma += white_factor * cc.MA_KING
-            elif piece in cc.BLACK_PIECES:
-                if piece == cc.B_PAWN:
-                    ma += black_factor * cc.MA_PAWN
-                elif piece == cc.B_KNIGHT:
-                    ma += black_factor * cc.MA_KNIGHT
-                elif piece == cc.B_BISHOP:
-                    ma += black_factor * cc.MA_BISHOP
-                elif piece == cc.B_ROOK:
-                    ma += black_factor * cc.MA_ROOK
-                elif piece == cc.B_QUEEN:
-                    ma += black_factor * cc.MA_QUEEN
-                elif piece == cc.B_KING:
-                    ma += black_factor * cc.MA_KING
-    return ma
\ No newline at end of file
+        return value
+    return -value
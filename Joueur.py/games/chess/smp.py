@@ -0,0 +1,121 @@
+# Lazy SMP: the same search in several processes
+#
+# The interpreter lock lets only one thread search at a time, so the helpers
+# are processes, forked once for the game. For every move, each helper runs its
+# own iterative deepening on the root the main process is searching, sharing
+# nothing but the transposition table. Every other helper starts a depth ahead
+# and each one shuffles its moves differently, so they reach different parts of
+# the tree first and fill the table with results the others can use. When the
+# main search ends the helpers are stopped, and a helper's move is played if it
+# finished a deeper iteration than the main search.
+
+import multiprocessing
+import queue
+import random
+
+from games.chess import history
+from games.chess import interface
+from games.chess import search
+from games.chess import timing
+
+########## CONSTANTS ##########
+# Kinds of message from a helper
+DEPTH_DONE = 0  # (DEPTH_DONE, depth, encoded move, value)
+SEARCH_DONE = 1 # (SEARCH_DONE, helper index, nodes searched)
+# Seconds to wait for a message before checking the helpers are still running
+RESULT_WAIT_SECONDS = 0.1
+
+
+# Functions
+def helper(index, table, jobs, results, stop_event):
+    """Runs in a helper process. Searches the root of each job until the stop
+    event is set, sending every depth it finishes, then the nodes it searched.
+    A job of None ends the process.
+    """
+    history_table = history.HistoryTable()
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        fen, keys, qs_depth, generation, seed = job
+        state = interface.fen_to_GameState(fen)
+        state.keys = keys
+        table.generation = generation
+        history_table.age()
+        random.seed(seed)
+        search.stats.reset()
+
+        clock = timing.TimeManager(stop_event=stop_event)
+        pv = search.PrincipalVariation()
+        ordering = search.MoveOrdering()
+        best_value = None
+        for depth in range(1 + index % 2, search.MAX_PLY):
+            best_move, value = search.aspiration_search(state, depth, qs_depth, clock, history_table, table, pv, ordering, best_value)
+            if clock.stopped:
+                break
+            results.put((DEPTH_DONE, depth, best_move, value))
+            best_value = value
+            pv.new_iteration()
+        results.put((SEARCH_DONE, index, search.stats.total()))
+
+class LazySMP:
+    """Helper processes that search alongside the main search.
+    table has to be a SharedTranspositionTable, made before the helpers are forked.
+    """
+    __slots__ = ['table', 'stop_event', 'results', 'jobs', 'helpers']
+    def __init__(self, threads, table):
+        context = multiprocessing.get_context("fork")
+        self.table      = table
+        self.stop_event = context.Event()   # Set when the main search is done
+        self.results    = context.Queue()   # Messages from every helper
+        self.jobs       = []                # Queue of roots to search, per helper
+        self.helpers    = []
+        for index in range(1, threads):
+            jobs = context.Queue()
+            process = context.Process(target=helper, args=(index, table, jobs, self.results, self.stop_event), daemon=True)
+            process.start()
+            self.jobs.append(jobs)
+            self.helpers.append(process)
+
+    def search(self, state, qs_depth, history_table, pv, ordering, percentage, time_remaining):
+        """Searches the state in the main process and the helpers at once.
+        :return: list of (encoded move, value), as tl_ht_qs_ab_id_dl_minimax,
+        with a helper's result last if it went deeper
+        """
+        self.stop_event.clear()
+        # Helpers by index, for the ones still running
+        waiting = {}
+        for index, (jobs, process) in enumerate(zip(self.jobs, self.helpers), 1):
+            if process.is_alive():
+                jobs.put((state.get_fen(), state.keys, qs_depth, self.table.generation, random.getrandbits(32)))
+                waiting[index] = process
+        values = search.tl_ht_qs_ab_id_dl_minimax(state, qs_depth, history_table, self.table, percentage, time_remaining, pv, ordering)
+        self.stop_event.set()
+
+        deepest = None
+        nodes = 0
+        while waiting:
+            try:
+                message = self.results.get(timeout=RESULT_WAIT_SECONDS)
+            except queue.Empty:
+                # A helper that died won't say it is done
+                waiting = {index: process for index, process in waiting.items() if process.is_alive()}
+                continue
+            if message[0] == SEARCH_DONE:
+                nodes += message[2]
+                waiting.pop(message[1], None)
+            elif deepest is None or message[1] > deepest[1]:
+                deepest = message
+        print("Helpers searched {} nodes, deepest depth {}".format(nodes, deepest[1] if deepest else None))
+        # Only a deeper finished iteration beats the main search's
+        if deepest is not None and deepest[1] > search.stats.depth:
+            values.append((deepest[2], deepest[3]))
+        return values
+
+    def close(self):
+        """Ends the helpers and frees the shared table"""
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.helpers:
+            process.join()
+        self.table.close()
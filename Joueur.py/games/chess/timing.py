@@ -0,0 +1,87 @@
+# Time management for the search
+#
+# All times are integer nanoseconds from perf_counter_ns, the unit the server
+# reports the clock in, so short budgets are not rounded away. A move has two
+# limits. The soft limit decides whether another iteration is started: only if
+# its cost, guessed from the last iteration and the growth between iterations,
+# fits before the limit. It is stretched while the best move keeps changing.
+# The hard limit stops the search wherever it is, checked every POLL_NODES
+# nodes rather than after every move. It only applies once the first iteration
+# is done, so there is always a move to play, even with almost no time left.
+
+from time import perf_counter_ns
+
+########## CONSTANTS ##########
+NS_PER_SECOND = 1000000000
+# Nodes between clock checks, a power of 2 so the check is a mask
+POLL_NODES = 1024
+POLL_MASK = POLL_NODES - 1
+# Kept back from every move for the round trip to the server
+MOVE_OVERHEAD = 50 * 1000000
+# The hard limit is HARD_FACTOR soft limits, but never more than MAX_SHARE of the clock
+HARD_FACTOR = 4
+MAX_SHARE = 0.25
+# Soft limit stretch while the best move changed in the last iteration
+UNSTABLE_FACTOR = 2
+# Guessed growth of an iteration's time over the last one's, and its bounds
+DEFAULT_BRANCHING = 4
+MIN_BRANCHING = 1.5
+MAX_BRANCHING = 12
+
+
+class TimeManager:
+    """The time limits of one move decision. Without a clock it never stops,
+    unless told to or, in another process, the stop event is set.
+    """
+    __slots__ = ['start', 'soft', 'hard', 'stopped', 'stop_event', 'last_iteration', 'branching', 'best_move', 'unstable']
+    def __init__(self, time_remaining=None, percentage=None, stop_event=None):
+        self.start          = perf_counter_ns()
+        self.soft           = None              # ns from the start to stop starting iterations, None for no limit
+        self.hard           = None              # ns from the start to stop searching, None for no limit
+        self.stopped        = False             # Has the hard limit passed?
+        self.stop_event     = stop_event        # multiprocessing.Event that stops the search too, or None
+        self.last_iteration = None              # ns the last finished iteration took
+        self.branching      = DEFAULT_BRANCHING # Guessed growth from one iteration to the next
+        self.best_move      = None              # Best move of the last finished iteration
+        self.unstable       = False             # Did the last iteration change the best move?
+        if time_remaining is not None:
+            available = max(int(time_remaining) - MOVE_OVERHEAD, 0)
+            self.soft = int(available * percentage)
+            self.hard = min(self.soft * HARD_FACTOR, int(available * MAX_SHARE))
+
+    def elapsed(self):
+        return perf_counter_ns() - self.start
+
+    def stop(self):
+        """Stops the search from outside it, e.g. when pondering ends"""
+        self.stopped = True
+
+    def poll(self):
+        """Checks the hard limit, once an iteration is done. Returns whether
+        the search has to stop.
+        """
+        if self.hard is not None and self.last_iteration is not None and perf_counter_ns() - self.start >= self.hard:
+            self.stopped = True
+        elif self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+        return self.stopped
+
+    def start_iteration(self):
+        """Returns whether the next iteration is expected to finish in time.
+        The first iteration always starts, so there is a move to play.
+        """
+        if self.stopped:
+            return False
+        if self.soft is None or self.last_iteration is None:
+            return True
+        soft = self.soft * UNSTABLE_FACTOR if self.unstable else self.soft
+        return self.elapsed() + self.last_iteration * self.branching <= min(soft, self.hard)
+
+    def iteration_done(self, iteration_time, best_move):
+        """Records how long the iteration took and whether its best move changed"""
+        if self.last_iteration:
+            growth = iteration_time / self.last_iteration
+            self.branching = min(max(growth, MIN_BRANCHING), MAX_BRANCHING)
+        self.last_iteration = max(iteration_time, 1)
+        self.unstable = self.best_move is not None and best_move != self.best_move
+        self.best_move = best_move
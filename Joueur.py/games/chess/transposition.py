@@ -0,0 +1,204 @@
+# Transposition table for the alpha beta search
+#
+# Entries live in flat, preallocated arrays so the memory use is fixed by the
+# size given in MB. Entries are grouped in buckets of two: the first slot keeps
+# the deepest result (depth-preferred), the second is overwritten every time
+# (always-replace). Every search bumps the generation, so entries left over
+# from earlier moves of the game can be replaced before fresher ones.
+#
+# SharedTranspositionTable keeps the same arrays in a shared memory block, for
+# searches in several processes at once. There are no locks, so an entry can be
+# read while another process is half way through writing it. Each entry's key
+# is stored XORed with a check of its other fields, and an entry whose fields
+# don't match the check reads as a different position.
+
+from array import array
+from math import inf as infinity
+from multiprocessing import shared_memory
+
+########## CONSTANTS ##########
+# Bound types
+EXACT = 0
+LOWER = 1 # Score is at least this (fail high)
+UPPER = 2 # Score is at most this (fail low)
+
+BUCKET_SIZE = 2
+DEFAULT_MB = 16
+# Key + depth + score + bound + generation + move
+ENTRY_BYTES = 8 + 2 + 4 + 1 + 1 + 4
+
+class TranspositionTable:
+    """Fixed size hash table of search results indexed by Zobrist key"""
+    __slots__ = ['size', 'buckets', 'keys', 'depths', 'scores', 'bounds', 'generations', 'moves', 'generation']
+    def __init__(self, mb=DEFAULT_MB):
+        entries = max(BUCKET_SIZE, int(mb * 1024 * 1024) // ENTRY_BYTES)
+        self.buckets     = entries // BUCKET_SIZE
+        self.size        = self.buckets * BUCKET_SIZE   # Number of entries
+        self.keys        = array('Q', [0]) * self.size  # Zobrist key of the position
+        self.depths      = array('h', [-1]) * self.size # Depth searched, -1 for empty
+        self.scores      = array('i', [0]) * self.size  # Score found
+        self.bounds      = array('b', [0]) * self.size  # EXACT, LOWER or UPPER
+        self.generations = array('B', [0]) * self.size  # Search that stored the entry
+        self.moves       = array('I', [0]) * self.size  # Best encoded move found, 0 for none
+        self.generation  = 0                            # Current search
+
+    def new_search(self):
+        """Ages the table. Call once per move decision."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        """Empties the table"""
+        self.depths = array('h', [-1]) * self.size
+        self.moves = array('I', [0]) * self.size
+        self.generation = 0
+
+    def probe(self, key):
+        """Returns the index of the entry for the key, or -1 if there is none"""
+        index = (key % self.buckets) * BUCKET_SIZE
+        if self.keys[index] == key and self.depths[index] >= 0:
+            return index
+        index += 1
+        if self.keys[index] == key and self.depths[index] >= 0:
+            return index
+        return -1
+
+    def store(self, key, depth, score, bound, move):
+        """Saves a search result, picking the slot by the replacement scheme"""
+        if score == infinity or score == -infinity:
+            return
+        index = (key % self.buckets) * BUCKET_SIZE
+        # Depth-preferred slot: same position, at least as deep, or left over from an older search
+        if self.keys[index] == key or depth >= self.depths[index] or self.generations[index] != self.generation:
+            # Keep the old best move if this search didn't find one
+            if not move and self.keys[index] == key:
+                move = self.moves[index]
+        else:
+            # Always-replace slot
+            index += 1
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.scores[index] = score
+        self.bounds[index] = bound
+        self.generations[index] = self.generation
+        self.moves[index] = move or 0
+
+    def lookup(self, key, depth, alpha, beta):
+        """Returns (score, best move) for the key.
+        score is None unless the entry is deep enough and its bound decides the
+        (alpha, beta) window; the move is still returned for move ordering.
+        """
+        index = self.probe(key)
+        if index < 0:
+            return None, 0
+        move = self.moves[index]
+        if self.depths[index] >= depth:
+            score = self.scores[index]
+            bound = self.bounds[index]
+            if bound == EXACT:
+                return score, move
+            if bound == LOWER and score >= beta:
+                return score, move
+            if bound == UPPER and score <= alpha:
+                return score, move
+        return None, move
+
+
+def entry_check(depth, score, bound, move):
+    """Returns the 64 bit check of an entry's fields, XORed into its stored key"""
+    return (move << 32 | score & 0xFFFFFFFF) ^ (depth & 0xFF) << 48 ^ bound << 62
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in shared memory, written and read without locks.
+    Processes forked after it is made see the same entries.
+    """
+    __slots__ = ['memory']
+    def __init__(self, mb=DEFAULT_MB):
+        entries = max(BUCKET_SIZE, int(mb * 1024 * 1024) // ENTRY_BYTES)
+        self.buckets    = entries // BUCKET_SIZE
+        self.size       = self.buckets * BUCKET_SIZE
+        self.memory     = shared_memory.SharedMemory(create=True, size=self.size * ENTRY_BYTES)
+        self.generation = 0
+        # Widest fields first, so every array starts aligned
+        offset = 0
+        views = []
+        for typecode, width in (('Q', 8), ('i', 4), ('I', 4), ('h', 2), ('b', 1), ('B', 1)):
+            views.append(self.memory.buf[offset:offset + self.size * width].cast(typecode))
+            offset += self.size * width
+        self.keys, self.scores, self.moves, self.depths, self.bounds, self.generations = views
+        self.clear()
+
+    def clear(self):
+        """Empties the table"""
+        self.depths[:] = array('h', [-1]) * self.size
+        self.moves[:] = array('I', [0]) * self.size
+        self.generation = 0
+
+    def close(self):
+        """Frees the shared memory. The table can't be used afterwards."""
+        for view in (self.keys, self.scores, self.moves, self.depths, self.bounds, self.generations):
+            view.release()
+        self.memory.close()
+        self.memory.unlink()
+
+    def stored_key(self, index):
+        """Returns the key of the entry at the index, or -1 if its fields are torn"""
+        depth = self.depths[index]
+        if depth < 0:
+            return -1
+        return self.keys[index] ^ entry_check(depth, self.scores[index], self.bounds[index], self.moves[index])
+
+    def probe(self, key):
+        """Returns the index of the entry for the key, or -1 if there is none"""
+        index = (key % self.buckets) * BUCKET_SIZE
+        if self.stored_key(index) == key:
+            return index
+        index += 1
+        if self.stored_key(index) == key:
+            return index
+        return -1
+
+    def store(self, key, depth, score, bound, move):
+        """Saves a search result, picking the slot by the replacement scheme"""
+        if score == infinity or score == -infinity:
+            return
+        index = (key % self.buckets) * BUCKET_SIZE
+        same = self.stored_key(index) == key
+        # Depth-preferred slot: same position, at least as deep, or left over from an older search
+        if same or depth >= self.depths[index] or self.generations[index] != self.generation:
+            # Keep the old best move if this search didn't find one
+            if not move and same:
+                move = self.moves[index]
+        else:
+            # Always-replace slot
+            index += 1
+        move = move or 0
+        self.depths[index] = depth
+        self.scores[index] = score
+        self.bounds[index] = bound
+        self.generations[index] = self.generation
+        self.moves[index] = move
+        self.keys[index] = key ^ entry_check(depth, score, bound, move)
+
+    def lookup(self, key, depth, alpha, beta):
+        """Returns (score, best move) for the key, as TranspositionTable.lookup.
+        The fields are read once and checked against the key, so a torn entry
+        is never used.
+        """
+        index = (key % self.buckets) * BUCKET_SIZE
+        for index in (index, index + 1):
+            entry_depth = self.depths[index]
+            score = self.scores[index]
+            bound = self.bounds[index]
+            move = self.moves[index]
+            if entry_depth >= 0 and self.keys[index] ^ entry_check(entry_depth, score, bound, move) == key:
+                break
+        else:
+            return None, 0
+        if entry_depth >= depth:
+            if bound == EXACT:
+                return score, move
+            if bound == LOWER and score >= beta:
+                return score, move
+            if bound == UPPER and score <= alpha:
+                return score, move
+        return None, move
@@ -0,0 +1,53 @@
+# Zobrist hashing for chess positions
+#
+# Every (piece, square) pair, castle availability, en passant file and the side
+# to move gets a random 64 bit number. A position's key is the XOR of the
+# numbers for everything in it, so a move only has to XOR the parts it changed.
+
+import random
+
+########## CONSTANTS ##########
+# Seeded so every process builds the same keys
+SEED = 0x5A0B215
+_generator = random.Random(SEED)
+
+# FEN characters, ordered like the Polyglot book format
+PIECE_ORDER = "pPnNbBrRqQkK"
+CASTLE_ORDER = "KQkq"
+
+PIECE_KEYS = {piece: tuple(_generator.getrandbits(64) for _ in range(64)) for piece in PIECE_ORDER}
+CASTLE_KEYS = {castle: _generator.getrandbits(64) for castle in CASTLE_ORDER}
+EN_PASSANT_KEYS = tuple(_generator.getrandbits(64) for _ in range(8))
+BLACK_TO_MOVE_KEY = _generator.getrandbits(64)
+# Toggled on every move
+SIDE_KEY = BLACK_TO_MOVE_KEY
+
+
+# Functions
+def castles_key(castles_avail):
+    """Returns the key for a castle availability string, e.g. "KQkq" or "-" """
+    key = 0
+    for castle in castles_avail:
+        if castle in CASTLE_KEYS:
+            key ^= CASTLE_KEYS[castle]
+    return key
+
+def en_passant_key(en_passant):
+    """Returns the key for an en passant square index or None"""
+    if en_passant is not None:
+        return EN_PASSANT_KEYS[en_passant & 7]
+    return 0
+
+def get_key(squares, white_to_move, castles_avail, en_passant):
+    """Computes the key of a whole position from scratch.
+    squares is the list of 64 piece characters, a8 first.
+    """
+    key = 0
+    for sq, piece in enumerate(squares):
+        if piece in PIECE_KEYS:
+            key ^= PIECE_KEYS[piece][sq]
+    key ^= castles_key(castles_avail)
+    key ^= en_passant_key(en_passant)
+    if not white_to_move:
+        key ^= BLACK_TO_MOVE_KEY
+    return key